@@ -5,7 +5,8 @@ import sys
 sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
 import streamlit as st
 from helper_functions.utility import text_import, email_msg_import, check_password
-from logics.email_query_handler import full_workflow
+from logics.email_query_handler import full_workflow, warm_up_resources
+from helper_functions import llm
 import io
 import email
 
@@ -20,6 +21,13 @@ st.set_page_config(
 if not check_password():  
     st.stop()
 
+# Open the pooled OpenAI connection once per process before the first query comes in.
+llm.warm_up()
+# Identical queries (e.g. re-submitting after 'Back to Input') are served from the completion cache.
+llm.enable_completion_cache()
+# Load the vector databases, build the RAG chains and start the background event loop once per process, shared by every session.
+warm_up_resources()
+
 ## WHAT IS SHOWN ON THE APP STARTS FROM HERE!!!!
 
 # Initialize the session state for page navigation and inputs
@@ -67,7 +75,7 @@ if st.session_state.page == 'input':
         st.session_state.public_query = public_query
         st.session_state.email_elements = email_elements
         with st.spinner("Generating response..."):
-            st.session_state.response = full_workflow(st.session_state.public_query,st.session_state.email_elements)
+            st.session_state.response = full_workflow(st.session_state.public_query,st.session_state.email_elements,stream=True)
         st.session_state.page = 'output'
         st.rerun()
 
@@ -97,7 +105,11 @@ elif st.session_state.page == 'output':
     st.subheader("Generated Response:")
     st.write('To: ',st.session_state.email_elements.get('From'))
     st.write('CC: ',st.session_state.email_elements.get('CC'))
-    st.write(st.session_state.response)
+    if isinstance(st.session_state.response, llm.CompletionStream):
+        # Render the reply token by token, then keep the full text for later reruns.
+        st.session_state.response = st.write_stream(st.session_state.response)
+    else:
+        st.write(st.session_state.response)
     st.write(st.session_state.name_input)
     st.write(st.session_state.designation_input)
     
@@ -0,0 +1,23 @@
+# Builds (or resumes building) the water quality reference index data/vectordb_wq_reference.
+# Page extraction runs in PDF_PARSE_WORKERS processes; pages are cached in data/cache/pdf_pages.sqlite3 and chunks are
+# stored in checkpointed batches, so re-running after an interruption continues where the last run stopped.
+# Run from the repository root: python dev_tools/build_wq_reference.py
+
+import os
+import sys
+import time
+
+# Obtain current script's directory and go up one level to main directory
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(current_dir)
+sys.path.insert(0, root_dir)
+os.chdir(root_dir)
+
+from helper_functions.resource_registry import get_embeddings_model
+from logics.wq_reference_ingestion import build_wq_reference_vectordb
+
+# Guarded because page extraction runs in worker processes, which re-import this script where processes are spawned (Windows)
+if __name__ == '__main__':
+    start = time.perf_counter()
+    vectordb = build_wq_reference_vectordb(get_embeddings_model('text-embedding-3-small'))
+    print(f'{vectordb._collection.count()} chunks stored, completed in {time.perf_counter() - start:.1f}s')
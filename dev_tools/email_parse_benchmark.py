@@ -0,0 +1,30 @@
+# Benchmark: .msg parsing of the email archive with 1, 2, 4, ... worker processes (logics/email_archive_ingestion.py).
+# The archive is repeated to reach a realistic size, e.g. 30 copies of the 118 cases is about 3,500 messages.
+# Run from the repository root: python dev_tools/email_parse_benchmark.py [copies, default 30]
+
+import os
+import sys
+import time
+
+# Obtain current script's directory and go up one level to main directory
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(current_dir)
+sys.path.insert(0, root_dir)
+os.chdir(root_dir)
+
+from logics.email_archive_ingestion import EMAIL_ARCHIVE_DIR, archive_files, parse_messages
+
+if __name__ == '__main__':
+    copies = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    paths = [EMAIL_ARCHIVE_DIR + '/' + filename for filename in archive_files()] * copies
+    cores = os.cpu_count() or 1
+    worker_counts = sorted({1, *(2 ** i for i in range(1, cores.bit_length()) if 2 ** i <= cores), cores})
+
+    baseline = None
+    for workers in worker_counts:
+        start = time.perf_counter()
+        failures = sum(error is not None for _, _, error in parse_messages(paths, max_workers=workers))
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f'{workers:>3} workers: {len(paths)} messages in {elapsed:7.2f}s | {len(paths) / elapsed:7.1f} msg/s | '
+              f'{baseline / elapsed:5.2f}x | {failures} failed')
@@ -0,0 +1,40 @@
+# Micro-benchmark: get_water_quality_guidelines via pandas (previous implementation) against the pre-rendered parameter catalog.
+# Run from the repository root: python dev_tools/guideline_catalog_benchmark.py
+
+import os
+import sys
+import timeit
+
+# Obtain current script's directory and go up one level to main directory
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(current_dir)
+sys.path.insert(0, root_dir)
+os.chdir(root_dir)
+
+import pandas as pd
+from logics.water_quality_parameter_catalog import parameter_catalog, WQ_PARAMETERS_CSV
+
+water_quality_df = pd.read_csv(WQ_PARAMETERS_CSV)
+
+
+def pandas_guidelines(parameters):
+    wq_parameter_guidelines = water_quality_df[water_quality_df['Parameter List'].isin(parameters)]
+    return wq_parameter_guidelines.to_markdown()
+
+
+def catalog_guidelines(parameters):
+    return parameter_catalog.to_markdown(parameters)
+
+
+parameter_sets = {
+    'single': ['pH'],
+    'typical': ['pH', 'Fluoride', 'Chlorine (Free)', 'Monochloramine', 'Lead'],
+    'all': parameter_catalog.parameter_list,
+}
+
+number = 200
+for label, parameters in parameter_sets.items():
+    pandas_time = timeit.timeit(lambda: pandas_guidelines(parameters), number=number) / number
+    catalog_time = timeit.timeit(lambda: catalog_guidelines(parameters), number=number) / number
+    print(f'{label:>8} ({len(parameters)} parameters): pandas {pandas_time * 1e6:9.1f} us | '
+          f'catalog {catalog_time * 1e6:7.1f} us | {pandas_time / catalog_time:6.1f}x')
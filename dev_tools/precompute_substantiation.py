@@ -0,0 +1,22 @@
+# Batch job: precomputes the step 3 substantiation answer for every parameter in the consolidated WQ parameter catalog.
+# Answers are stored in data/cache/substantiation_cache.sqlite3 keyed by parameter, reference index version and prompt
+# version, so the online workflow only has to look them up. Re-run after rebuilding vectordb_wq_reference or editing the prompt.
+# Run from the repository root: python dev_tools/precompute_substantiation.py [parameter ...]
+
+import os
+import sys
+import time
+
+# Obtain current script's directory and go up one level to main directory
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(current_dir)
+sys.path.insert(0, root_dir)
+os.chdir(root_dir)
+
+from logics.water_quality_substantiation import precompute_substantiations
+
+# Guarded so that importing this module (e.g. to reuse precompute_substantiations) does not start the batch job
+if __name__ == '__main__':
+    start = time.perf_counter()
+    answers = precompute_substantiations(sys.argv[1:] or None)
+    print(f'Completed in {time.perf_counter() - start:.1f}s')
@@ -0,0 +1,101 @@
+# Checks of the client-side flow control in helper_functions/rate_limiter.py against mock backends; no API calls are made.
+# Run from the repository root: python dev_tools/rate_limiter_check.py
+
+import asyncio
+import os
+import random
+import sys
+
+# Obtain current script's directory and go up one level to main directory
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(current_dir)
+sys.path.insert(0, root_dir)
+os.chdir(root_dir)
+
+import httpx
+
+from helper_functions.circuit_breaker import CircuitBreaker
+from helper_functions.rate_limiter import AdaptiveConcurrencyLimiter, LimitedAsyncTransport, RateLimiter, latency_key
+
+# One email through the pipeline: (model, max_tokens, typical latency range in seconds) per call, as routed in
+# helper_functions/model_routing.py
+EMAIL_CALLS = (
+    ('gpt-4o-mini', 128, (0.4, 0.7)),        # initial_response
+    ('gpt-4o-mini', 256, (0.6, 1.2)),        # identify_water_quality_parameter
+    ('gpt-4o-mini', 512, (2.0, 4.0)),        # substantiate_water_quality_parameter
+    ('gpt-4o-mini', 1024, (4.0, 7.0)),       # generate_response_based_on_water_quality_standards
+    ('gpt-4o-mini', 1536, (9.0, 14.0)),      # response_consolidation
+)
+
+
+def _chat_request(model, max_tokens):
+    return httpx.Request('POST', 'https://api.openai.com/v1/chat/completions',
+                         json={'model': model, 'max_tokens': max_tokens, 'messages': []})
+
+
+def check_mixed_latency_keeps_limit(emails=50, seed=0):
+    # Healthy traffic with short and long calls interleaved must not be read as latency spikes
+    rng = random.Random(seed)
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=8)
+    initial = limiter.limit
+    calls = [call for _ in range(emails) for call in EMAIL_CALLS]
+    rng.shuffle(calls)
+    for model, max_tokens, (low, high) in calls:
+        request = _chat_request(model, max_tokens)
+        assert limiter.try_acquire()
+        limiter.release(latency_key(request, {'model': model, 'max_tokens': max_tokens}), latency=rng.uniform(low, high))
+    assert limiter.limit >= initial, f'limit fell from {initial} to {limiter.limit:.2f} without any throttling'
+    return f'limit {initial:g} -> {limiter.limit:.2f} over {len(calls)} mixed calls'
+
+
+def check_latency_spike_still_backs_off():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=8)
+    key = latency_key(_chat_request('gpt-4o-mini', 128), {'model': 'gpt-4o-mini', 'max_tokens': 128})
+    for _ in range(10):
+        limiter.try_acquire()
+        limiter.release(key, latency=0.5)
+    before = limiter.limit
+    limiter.try_acquire()
+    limiter.release(key, latency=5.0)
+    assert limiter.limit < before, 'a 10x slower call of the same kind should decrease the limit'
+    return f'limit {before:.2f} -> {limiter.limit:.2f} after a spike'
+
+
+class _UnreachableTransport(httpx.AsyncBaseTransport):
+    async def handle_async_request(self, request):
+        raise AssertionError('the request should never be sent')
+
+
+def check_cancelled_slot_wait_releases_probe():
+    # A half-open breaker lets one probe through. If the probe's task is cancelled while it waits for a concurrency slot
+    # (hedge loser, Streamlit rerun), the probe must be handed back or every later call fails fast.
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.0)
+    breaker.record_failure()
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=1)
+    assert limiter.try_acquire()        # the only slot is taken, so the request below waits in acquire_async
+    transport = LimitedAsyncTransport(RateLimiter(10000, 10 ** 9), limiter, lambda payload: 1, circuit_breaker=breaker)
+    transport._transport = _UnreachableTransport()
+
+    async def cancel_while_waiting():
+        task = asyncio.ensure_future(transport.handle_async_request(_chat_request('gpt-4o-mini', 128)))
+        await asyncio.sleep(0.2)
+        assert breaker.state == 'half_open' and breaker._probe_in_flight
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(cancel_while_waiting())
+    assert not breaker._probe_in_flight, 'cancelled probe still marked as in flight'
+    assert limiter.in_flight == 1, 'a slot that was never acquired was released'
+    breaker.before_call()               # a new probe is let through instead of CircuitOpenError
+    return f'breaker {breaker.state}, probe handed back, in_flight {limiter.in_flight}'
+
+
+CHECKS = (check_mixed_latency_keeps_limit, check_latency_spike_still_backs_off, check_cancelled_slot_wait_releases_probe)
+
+if __name__ == '__main__':
+    for check in CHECKS:
+        print(f'{check.__name__}: {check()}')
+    print(f'{len(CHECKS)} checks passed.')
@@ -0,0 +1,41 @@
+# Compares semantic chunking breakpoint thresholds on the email archive from a single embedding pass.
+# The archive is parsed and its sentences embedded once (served from the embedding store after the first run); each
+# threshold then only costs a NumPy percentile and a join. Build a variant's collection with
+# python dev_tools/sync_email_vectordb.py email_semantic_<percentile>
+# Run from the repository root: python dev_tools/semantic_threshold_variants.py [percentile ...], default 80 95 98 100
+
+import os
+import sys
+import time
+
+# Obtain current script's directory and go up one level to main directory
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(current_dir)
+sys.path.insert(0, root_dir)
+os.chdir(root_dir)
+
+from helper_functions.resource_registry import get_embeddings_model
+from helper_functions.semantic_chunking import SemanticChunking
+from logics.email_archive_ingestion import EMAIL_ARCHIVE_DIR, archive_files, parse_messages
+
+if __name__ == '__main__':
+    percentiles = [float(value) for value in sys.argv[1:]] or [80, 95, 98, 100]
+    paths = [EMAIL_ARCHIVE_DIR + '/' + filename for filename in archive_files()]
+    texts = [document.page_content for _, document, error in parse_messages(paths) if error is None]
+
+    start = time.perf_counter()
+    analyses = SemanticChunking(get_embeddings_model('text-embedding-3-small')).analyse(texts)
+    print(f'Embedding pass: {len(texts)} emails, {sum(len(a.sentences) for a in analyses)} sentences '
+          f'in {time.perf_counter() - start:.2f}s')
+
+    start = time.perf_counter()
+    chunks = {percentile: [] for percentile in percentiles}
+    for analysis in analyses:
+        for percentile, indices in analysis.breakpoints(percentiles).items():
+            chunks[percentile].extend(analysis.chunks(indices))
+    print(f'Breakpoints for {len(percentiles)} thresholds in {time.perf_counter() - start:.3f}s')
+
+    for percentile, percentile_chunks in chunks.items():
+        lengths = sorted(len(chunk) for chunk in percentile_chunks)
+        print(f'{percentile:>6g}th percentile: {len(lengths):5d} chunks | median {lengths[len(lengths) // 2]:6d} chars | '
+              f'max {lengths[-1]:6d} chars')
@@ -0,0 +1,25 @@
+# Incrementally syncs the email archive vectordb with data/Queries Received and Email Responses.
+# Only new or changed .msg files are parsed, chunked and embedded; chunks of removed files are deleted.
+# Run from the repository root: python dev_tools/sync_email_vectordb.py [vectordb name, default email_semantic_98]
+
+import os
+import sys
+import time
+
+# Obtain current script's directory and go up one level to main directory
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(current_dir)
+sys.path.insert(0, root_dir)
+os.chdir(root_dir)
+
+from helper_functions.resource_registry import get_embeddings_model
+from logics.email_archive_ingestion import open_email_vectordb, sync_email_vectordb
+
+# Guarded because .msg parsing runs in worker processes, which re-import this script where processes are spawned (Windows)
+if __name__ == '__main__':
+    vectordb_name = sys.argv[1] if len(sys.argv) > 1 else 'email_semantic_98'
+    embeddings_model = get_embeddings_model('text-embedding-3-small')
+
+    start = time.perf_counter()
+    sync_email_vectordb(open_email_vectordb(embeddings_model, vectordb_name), embeddings_model, vectordb_name)
+    print(f'Completed in {time.perf_counter() - start:.1f}s')
@@ -0,0 +1,41 @@
+# Benchmark: chunking the reference PDFs with RecursiveCharacterTextSplitter(length_function=count_tokens), the previous
+# splitter, against TokenOffsetTextSplitter (helper_functions/token_splitter.py), both at chunk_size=500 / overlap=50.
+# Pages come from the page cache of logics/wq_reference_ingestion.py, so only the splitting is timed.
+# Run from the repository root: python dev_tools/token_splitter_benchmark.py
+
+import os
+import sys
+import time
+
+# Obtain current script's directory and go up one level to main directory
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(current_dir)
+sys.path.insert(0, root_dir)
+os.chdir(root_dir)
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from helper_functions.llm import count_tokens
+from logics.wq_reference_ingestion import (REFERENCE_PDFS, CHUNK_SIZE, CHUNK_OVERLAP, PageCache, file_hash, iter_pages,
+                                           reference_splitter)
+
+if __name__ == '__main__':
+    pages = list(iter_pages([(path, file_hash(path)) for path in REFERENCE_PDFS], PageCache()))
+    splitters = {
+        'count_tokens': RecursiveCharacterTextSplitter(separators=["\n\n", "\n", " ", ""], chunk_size=CHUNK_SIZE,
+                                                       chunk_overlap=CHUNK_OVERLAP, length_function=count_tokens),
+        'token_offset': reference_splitter(),
+    }
+
+    chunks = {}
+    for label, splitter in splitters.items():
+        start = time.perf_counter()
+        chunks[label] = [chunk.page_content for chunk in splitter.split_documents(pages)]
+        elapsed = time.perf_counter() - start
+        sizes = [count_tokens(chunk) for chunk in chunks[label]]
+        print(f'{label:>13}: {len(pages)} pages -> {len(sizes)} chunks in {elapsed:7.2f}s | '
+              f'max {max(sizes)} tokens | over {CHUNK_SIZE}: {sum(size > CHUNK_SIZE for size in sizes)}')
+
+    identical = len(set(chunks['count_tokens']) & set(chunks['token_offset']))
+    print(f'Identical chunks: {identical} of {len(chunks["count_tokens"])} '
+          f'({identical / max(1, len(chunks["count_tokens"])):.1%})')
@@ -0,0 +1,73 @@
+# One long-lived asyncio event loop per process, running in a daemon thread.
+# Sync code (Streamlit scripts, CLI entry points) submits coroutines to it instead of calling asyncio.run per request, so
+# loop-bound state such as the per-loop AsyncOpenAI client and its httpx connection pool (helper_functions/llm.py)
+# survives across requests. Submitting also works when the caller's own thread already runs an event loop.
+
+import asyncio
+import threading
+
+
+class BackgroundLoop:
+    def __init__(self, name='background-loop'):
+        self.name = name
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self.submitted = 0
+
+    def start(self):
+        # Idempotent; returns the running loop.
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+                thread = threading.Thread(target=self._run, args=(loop, ready), name=self.name, daemon=True)
+                thread.start()
+                ready.wait()
+                self._loop, self._thread = loop, thread
+            return self._loop
+
+    def _run(self, loop, ready):
+        asyncio.set_event_loop(loop)
+        loop.call_soon(ready.set)
+        try:
+            loop.run_forever()
+        finally:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+
+    def in_loop_thread(self):
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def submit(self, coro):
+        # Thread-safe; returns a concurrent.futures.Future. Cancelling the future cancels the task on the loop.
+        loop = self.start()
+        with self._lock:
+            self.submitted += 1
+        return asyncio.run_coroutine_threadsafe(coro, loop)
+
+    def run(self, coro, timeout=None):
+        # Blocking counterpart of submit for sync callers.
+        if self.in_loop_thread():
+            coro.close()
+            raise RuntimeError('BackgroundLoop.run() called from the loop thread; await the coroutine instead')
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    def stop(self, timeout=5):
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(timeout)
+
+    def stats(self):
+        return {'running': self._loop is not None and self._loop.is_running(), 'submitted': self.submitted}
+
+
+background_loop = BackgroundLoop('wq-async-loop')
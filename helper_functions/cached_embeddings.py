@@ -0,0 +1,29 @@
+# LangChain embeddings wrapper that routes every call through the cached helpers in llm.py.
+# Drop-in replacement for OpenAIEmbeddings(model='text-embedding-3-small') in the vector store code.
+
+from langchain_core.embeddings import Embeddings
+
+from helper_functions import llm
+
+
+class CachedOpenAIEmbeddings(Embeddings):
+    def __init__(self, model='text-embedding-3-small', call_site='langchain_embeddings'):
+        self.model = model
+        self.call_site = call_site
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        # Document batches come from index builds, so they go through the token-aware bulk path.
+        return llm.embed_many(list(texts), model=self.model, call_site=self.call_site)
+
+    def embed_query(self, text):
+        return llm.get_embedding([text], model=self.model, call_site=self.call_site)[0]
+
+    async def aembed_documents(self, texts):
+        if not texts:
+            return []
+        return await llm.get_embedding_async(list(texts), model=self.model, call_site=self.call_site)
+
+    async def aembed_query(self, text):
+        return (await llm.get_embedding_async([text], model=self.model, call_site=self.call_site))[0]
@@ -0,0 +1,62 @@
+# Circuit breaker for the OpenAI backend.
+# closed: calls go through; consecutive failures are counted.
+# open: after failure_threshold consecutive failures or timeouts every call fails fast with CircuitOpenError.
+# half_open: after recovery_timeout seconds one probe call is let through; success closes the circuit, failure re-opens it.
+
+import threading
+import time
+
+import httpx
+
+
+class CircuitOpenError(httpx.TransportError):
+    # Subclasses httpx.TransportError so the OpenAI SDK and LangChain surface it like any other connection failure.
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, recovery_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == 'closed':
+                return
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.recovery_timeout:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+            raise CircuitOpenError('OpenAI circuit breaker is open, failing fast')
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == 'half_open' or self.consecutive_failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def release_probe(self):
+        # For calls that were cancelled rather than failed: the outcome is unknown, so the state stays as it is
+        with self._lock:
+            self._probe_in_flight = False
+
+    def is_open(self):
+        with self._lock:
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.recovery_timeout:
+                # Due for a probe, so callers should try again rather than fall back.
+                return False
+            return self.state != 'closed'
@@ -0,0 +1,123 @@
+# Exact-match cache for chat completions.
+# Two tiers: a small in-memory LRU for the current process and an on-disk SQLite store that survives restarts.
+# Entries are keyed on a hash of every request parameter that can change the model output.
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_cache_key(model, messages, temperature, top_p, max_tokens, response_format):
+    payload = {
+        'model': model,
+        'messages': messages,
+        'temperature': temperature,
+        'top_p': top_p,
+        'max_tokens': max_tokens,
+        'response_format': response_format,
+    }
+    serialized = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+class CompletionCache:
+    def __init__(self, path='data/cache/completion_cache.sqlite3', max_memory_items=256,
+                 max_disk_items=20000, ttl_seconds=7 * 24 * 3600):
+        self.path = path
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+        self.ttl_seconds = ttl_seconds
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # A single connection shared across Streamlit threads, serialised by self._lock.
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS completions ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_completions_accessed ON completions (accessed)')
+        self._conn.commit()
+
+    def _remember(self, key, value, created):
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created = entry
+                if now - created <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return value
+                del self._memory[key]
+
+            row = self._conn.execute('SELECT value, created FROM completions WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                value, created = row
+                if now - created <= self.ttl_seconds:
+                    self._conn.execute('UPDATE completions SET accessed = ? WHERE key = ?', (now, key))
+                    self._conn.commit()
+                    self._remember(key, value, created)
+                    self.disk_hits += 1
+                    return value
+                self._conn.execute('DELETE FROM completions WHERE key = ?', (key,))
+                self._conn.commit()
+
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        if value is None:
+            return
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            self._conn.execute(
+                'INSERT OR REPLACE INTO completions (key, value, created, accessed) VALUES (?, ?, ?, ?)',
+                (key, value, now, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        # Expired rows first, then least recently used rows beyond the size bound.
+        self._conn.execute('DELETE FROM completions WHERE created < ?', (now - self.ttl_seconds,))
+        (count,) = self._conn.execute('SELECT COUNT(*) FROM completions').fetchone()
+        overflow = count - self.max_disk_items
+        if overflow > 0:
+            self._conn.execute(
+                'DELETE FROM completions WHERE key IN (SELECT key FROM completions ORDER BY accessed ASC LIMIT ?)',
+                (overflow,)
+            )
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._conn.execute('DELETE FROM completions')
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            (disk_items,) = self._conn.execute('SELECT COUNT(*) FROM completions').fetchone()
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'memory_items': len(self._memory),
+                'disk_items': disk_items,
+            }
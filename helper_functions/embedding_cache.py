@@ -0,0 +1,176 @@
+# Content-addressed embedding store.
+# Vectors are keyed by (model, sha256(text)) and appended to a float32 file per model that is read back through numpy.memmap.
+# A plain text index next to it holds one sha256 per line; the line number is the row of the vector in the float32 file.
+
+import hashlib
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+import numpy as np
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+@contextmanager
+def _file_lock(path):
+    # Exclusive lock across processes (the apps and the dev_tools ingestion scripts share the store).
+    with open(path, 'a+b') as f:
+        if os.name == 'nt':
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if os.name == 'nt':
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class _ModelStore:
+    # Files and in-memory index for a single embedding model.
+    # Appends happen under a file lock after re-reading the index, so rows written by other processes are never
+    # overwritten and row numbers stay aligned with the index.
+    def __init__(self, directory, model):
+        safe_name = re.sub(r'[^A-Za-z0-9_.-]', '_', model)
+        self.vectors_path = os.path.join(directory, f'{safe_name}.f32')
+        self.index_path = os.path.join(directory, f'{safe_name}.idx')
+        self.meta_path = os.path.join(directory, f'{safe_name}.json')
+        self.lock_path = os.path.join(directory, f'{safe_name}.lock')
+        self.dim = None
+        self.rows = {}
+        self._index_lines = 0     # rows read so far; the index may list a text twice if two writers raced
+        self._index_bytes = 0
+        self._mmap = None
+        self._mapped_rows = 0
+        self._file_sizes = None
+        self.refresh_if_changed()
+
+    def refresh_if_changed(self):
+        # Picks up rows appended by other processes. An unchanged store costs three stat calls.
+        file_sizes = tuple(os.path.getsize(path) if os.path.exists(path) else 0
+                           for path in (self.meta_path, self.index_path, self.vectors_path))
+        if file_sizes != self._file_sizes:
+            self._file_sizes = file_sizes
+            self._refresh()
+
+    def _refresh(self, repair=False):
+        # Reads index lines appended since the last refresh. Only rows present in both files are trusted: a crash
+        # between the two appends can leave one file longer than the other. With repair=True (file lock held) that
+        # unmatched tail is cut off before the next append.
+        if self.dim is None and os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r') as f:
+                self.dim = json.load(f)['dim']
+        if not self.dim or not os.path.exists(self.index_path):
+            return
+        row_bytes = 4 * self.dim
+        vector_rows = os.path.getsize(self.vectors_path) // row_bytes if os.path.exists(self.vectors_path) else 0
+        with open(self.index_path, 'rb') as f:
+            f.seek(self._index_bytes)
+            tail = f.read()
+        for line in tail.splitlines(keepends=True):
+            if not line.endswith(b'\n') or self._index_lines >= vector_rows:
+                break
+            self.rows.setdefault(line.strip().decode('ascii'), self._index_lines)
+            self._index_lines += 1
+            self._index_bytes += len(line)
+        if repair:
+            if os.path.getsize(self.index_path) > self._index_bytes:
+                with open(self.index_path, 'r+b') as f:
+                    f.truncate(self._index_bytes)
+            if vector_rows > self._index_lines:
+                with open(self.vectors_path, 'r+b') as f:
+                    f.truncate(self._index_lines * row_bytes)
+
+    def _vectors(self):
+        if self._mmap is None or self._mapped_rows < self._index_lines:
+            self._mmap = np.memmap(self.vectors_path, dtype=np.float32, mode='r').reshape(-1, self.dim)
+            self._mapped_rows = self._mmap.shape[0]
+        return self._mmap
+
+    def get(self, key):
+        row = self.rows.get(key)
+        if row is None:
+            return None
+        return np.array(self._vectors()[row])
+
+    def put_many(self, keys, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with _file_lock(self.lock_path):
+            self._refresh(repair=True)
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                # Replaced atomically, as readers load it without taking the lock
+                with open(self.meta_path + '.tmp', 'w') as f:
+                    json.dump({'dim': self.dim}, f)
+                os.replace(self.meta_path + '.tmp', self.meta_path)
+            new_keys = []
+            new_vectors = []
+            for key, vector in zip(keys, vectors):
+                if key not in self.rows and key not in new_keys:
+                    new_keys.append(key)
+                    new_vectors.append(vector)
+            if not new_keys:
+                return
+            with open(self.vectors_path, 'ab') as f:
+                f.write(np.stack(new_vectors).astype(np.float32).tobytes())
+            lines = ''.join(f'{key}\n' for key in new_keys).encode('ascii')
+            with open(self.index_path, 'ab') as f:
+                f.write(lines)
+            for key in new_keys:
+                self.rows[key] = self._index_lines
+                self._index_lines += 1
+            self._index_bytes += len(lines)
+
+
+class EmbeddingStore:
+    def __init__(self, directory='data/cache/embeddings'):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._models = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _model_store(self, model):
+        store = self._models.get(model)
+        if store is None:
+            store = _ModelStore(self.directory, model)
+            self._models[model] = store
+        return store
+
+    def get_many(self, model, texts):
+        # Returns one vector per text, or None where the text has not been embedded before.
+        with self._lock:
+            store = self._model_store(model)
+            store.refresh_if_changed()
+            results = [store.get(text_hash(text)) for text in texts]
+            hit_count = sum(1 for r in results if r is not None)
+            self.hits += hit_count
+            self.misses += len(texts) - hit_count
+            return results
+
+    def put_many(self, model, texts, vectors):
+        with self._lock:
+            self._model_store(model).put_many([text_hash(text) for text in texts], vectors)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'items': {model: len(store.rows) for model, store in self._models.items()},
+            }
@@ -0,0 +1,67 @@
+# Factory for the LangChain chat models used by the RAG chains.
+# The models share the rate-limited httpx clients from llm.py, so they are throttled and retried like the plain helpers,
+# and report to the same telemetry through TelemetryCallbackHandler.
+
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_openai import ChatOpenAI
+
+from helper_functions import llm
+from helper_functions import model_routing
+from helper_functions.resource_registry import resources
+from helper_functions.telemetry import telemetry
+
+
+class TelemetryCallbackHandler(BaseCallbackHandler):
+    def __init__(self, call_site, model):
+        self.call_site = call_site
+        self.model = model
+        self._runs = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._runs[run_id] = {'start': time.perf_counter(), 'ttft': None}
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        run = self._runs.get(run_id)
+        if run is not None and run['ttft'] is None:
+            run['ttft'] = time.perf_counter() - run['start']
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        llm_output = response.llm_output or {}
+        usage = llm_output.get('token_usage') or {}
+        telemetry.record_call(
+            self.call_site, llm_output.get('model_name', self.model), time.perf_counter() - run['start'],
+            ttft=run['ttft'],
+            prompt_tokens=usage.get('prompt_tokens', 0),
+            completion_tokens=usage.get('completion_tokens', 0),
+        )
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            telemetry.record_call(self.call_site, self.model, time.perf_counter() - run['start'], error=error)
+
+
+# model, max_tokens and timeout default to the route for call_site in helper_functions/model_routing.py.
+def create_chat_model(model=None, call_site=None, max_tokens=None, timeout=None, **kwargs):
+    route = model_routing.resolve_route(call_site, model=model, max_tokens=max_tokens, timeout=timeout)
+    return ChatOpenAI(
+        model=route.model,
+        max_tokens=route.max_tokens,
+        timeout=route.timeout,
+        http_client=llm.get_http_client(),
+        http_async_client=llm.new_async_http_client(),
+        max_retries=0,
+        callbacks=[TelemetryCallbackHandler(call_site, route.model)],
+        **kwargs
+    )
+
+
+# Shared instance of create_chat_model(call_site=call_site, **kwargs), created once per process.
+def get_chat_model(call_site, **kwargs):
+    key = ('chat_model', call_site, tuple(sorted(kwargs.items())))
+    return resources.get(key, lambda: create_chat_model(call_site=call_site, **kwargs))
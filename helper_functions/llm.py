@@ -1,77 +1,592 @@
 import os
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+import httpx
 import tiktoken
+from helper_functions.completion_cache import CompletionCache, make_cache_key
+from helper_functions.embedding_cache import EmbeddingStore
+from helper_functions import rate_limiter
+from helper_functions.singleflight import SingleFlight
+from helper_functions.telemetry import telemetry
+from helper_functions.circuit_breaker import CircuitBreaker
+from helper_functions import model_routing
 
 import asyncio
+import hashlib
+import json
+import threading
+import time
+import weakref
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from functools import lru_cache
 
 load_dotenv('.env')
 
-# Load APIKey into OpenAI Model
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+# Connection pool settings shared by the sync and async clients.
+# Keep-alive connections let every officer session reuse the same TLS connection instead of paying a new handshake per call.
+HTTP_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', 20))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('OPENAI_MAX_KEEPALIVE_CONNECTIONS', 10))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv('OPENAI_KEEPALIVE_EXPIRY', 60))
+HTTP_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', 60))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('OPENAI_CONNECT_TIMEOUT', 10))
+# Retries of 429/5xx responses are done by the rate-limited transport, so the SDK's own retries are switched off.
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 5))
 
-# Helper Function 1 : Generate Embedding
-def get_embedding(input, model='text-embedding-3-small'):
-    response = client.embeddings.create(
-        input=input,
-        model=model
+# Per-request limits of the embeddings endpoint, used by embed_many() to pack sub-batches.
+EMBEDDING_MAX_TOKENS_PER_REQUEST = int(os.getenv('EMBEDDING_MAX_TOKENS_PER_REQUEST', 300000))
+EMBEDDING_MAX_ITEMS_PER_REQUEST = int(os.getenv('EMBEDDING_MAX_ITEMS_PER_REQUEST', 2048))
+EMBEDDING_MAX_WORKERS = int(os.getenv('EMBEDDING_MAX_WORKERS', 4))
+# Threads that run the duplicate request of a hedged sync completion; when all are busy, calls are not hedged.
+LLM_HEDGE_WORKERS = int(os.getenv('LLM_HEDGE_WORKERS', 8))
+
+_client = None
+_http_client = None
+_client_lock = threading.Lock()
+# httpx async connections are bound to the event loop that opened them, so one async client is kept per running loop.
+_async_clients = weakref.WeakKeyDictionary()
+_warmed_up = False
+# Opt-in exact-match completion cache, see enable_completion_cache().
+completion_cache = None
+# Content-addressed embedding cache, on by default since embeddings are deterministic. Set LLM_EMBEDDING_CACHE=0 to disable.
+embedding_store = None
+# Identical requests already in flight (double-clicked Submit, two officers on the same email) share one API call.
+request_flight = SingleFlight()
+# Shared by every transport below: once the backend keeps failing, all calls fail fast until a probe succeeds.
+_hedge_executor = ThreadPoolExecutor(max_workers=LLM_HEDGE_WORKERS, thread_name_prefix='llm-hedge')
+_hedge_slots = threading.BoundedSemaphore(LLM_HEDGE_WORKERS)
+# Embedding store reads and writes (file I/O and a cross-process lock) run here rather than on the event loop
+_embedding_store_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='embedding-store')
+backend_breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv('OPENAI_BREAKER_FAILURES', 5)),
+    recovery_timeout=float(os.getenv('OPENAI_BREAKER_RECOVERY_SECONDS', 30)),
+)
+
+
+def _http_limits():
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
     )
-    return [x.embedding for x in response.data]
 
-# Helper Function 2 : Call out LLM
-def get_completion(prompt, model="gpt-4o-mini", temperature=0, top_p=1.0, max_tokens=1024, n=1, json_output=False):
+
+def _http_timeout():
+    return httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+
+
+def _estimate_request_tokens(payload):
+    # Token cost charged against the tokens-per-minute bucket before a request is sent.
+    if 'messages' in payload:
+        messages = [m for m in payload['messages'] if isinstance(m.get('content'), str)]
+        return count_tokens_from_message(messages) + (payload.get('max_tokens') or 0)
+    if 'input' in payload:
+        texts = [payload['input']] if isinstance(payload['input'], str) else payload['input']
+        return sum(count_tokens(t) for t in texts if isinstance(t, str))
+    return 0
+
+
+def _limited_transport():
+    return rate_limiter.LimitedTransport(
+        rate_limiter.rate_limiter, rate_limiter.concurrency_limiter, _estimate_request_tokens,
+        max_retries=LLM_MAX_RETRIES, circuit_breaker=backend_breaker, limits=_http_limits(),
+    )
+
+
+def _limited_async_transport():
+    return rate_limiter.LimitedAsyncTransport(
+        rate_limiter.rate_limiter, rate_limiter.concurrency_limiter, _estimate_request_tokens,
+        max_retries=LLM_MAX_RETRIES, circuit_breaker=backend_breaker, limits=_http_limits(),
+    )
+
+
+# Shared httpx clients. Every request through them is rate limited, concurrency limited and retried.
+# The LangChain models in helper_functions/langchain_models.py are built on these as well.
+def get_http_client():
+    global _http_client
+    if _http_client is None:
+        with _client_lock:
+            if _http_client is None:
+                _http_client = httpx.Client(transport=_limited_transport(), timeout=_http_timeout())
+    return _http_client
+
+
+def new_async_http_client():
+    return httpx.AsyncClient(transport=_limited_async_transport(), timeout=_http_timeout())
+
+
+# Load APIKey into OpenAI Model. The client is created once per process and shared by every helper below.
+def get_client():
+    global _client
+    if _client is None:
+        http_client = get_http_client()
+        with _client_lock:
+            if _client is None:
+                _client = OpenAI(
+                    api_key=os.getenv('OPENAI_API_KEY'),
+                    http_client=http_client,
+                    max_retries=0,
+                )
+    return _client
+
+
+def get_async_client():
+    # Must be called from inside a running event loop.
+    loop = asyncio.get_running_loop()
+    async_client = _async_clients.get(loop)
+    if async_client is None:
+        with _client_lock:
+            async_client = _async_clients.get(loop)
+            if async_client is None:
+                async_client = AsyncOpenAI(
+                    api_key=os.getenv('OPENAI_API_KEY'),
+                    http_client=new_async_http_client(),
+                    max_retries=0,
+                )
+                _async_clients[loop] = async_client
+    return async_client
+
+
+def warm_up():
+    # Open the TLS connection to the API ahead of the first officer query. Safe to call on every Streamlit rerun.
+    global _warmed_up
+    if _warmed_up or os.getenv('OPENAI_WARMUP', '1') == '0':
+        return
+    _warmed_up = True
+    try:
+        get_client().models.list()
+    except Exception as e:
+        print(f'OpenAI warm-up failed: {e}')
+
+
+def enable_completion_cache(**cache_kwargs):
+    # Turn on the exact-match completion cache for this process. Safe to call on every Streamlit rerun.
+    global completion_cache
+    if completion_cache is None:
+        with _client_lock:
+            if completion_cache is None:
+                completion_cache = CompletionCache(**cache_kwargs)
+    return completion_cache
+
+
+def completion_cache_stats():
+    if completion_cache is None:
+        return None
+    return completion_cache.stats()
+
+
+if os.getenv('LLM_COMPLETION_CACHE', '0') == '1':
+    enable_completion_cache()
+
+
+def get_embedding_store():
+    global embedding_store
+    if embedding_store is None and os.getenv('LLM_EMBEDDING_CACHE', '1') == '1':
+        with _client_lock:
+            if embedding_store is None:
+                embedding_store = EmbeddingStore()
+    return embedding_store
+
+
+def _record_call(call_site, model, start, response=None, error=None, ttft=None):
+    usage = getattr(response, 'usage', None)
+    telemetry.record_call(
+        call_site, model, time.perf_counter() - start, ttft=ttft,
+        prompt_tokens=getattr(usage, 'prompt_tokens', 0) or 0,
+        completion_tokens=getattr(usage, 'completion_tokens', 0) or 0,
+        error=error,
+    )
+
+
+def _response_format(json_output):
     if json_output == True:
-      output_json_structure = {"type": "json_object"}
-    else:
-      output_json_structure = None
+        return {"type": "json_object"}
+    return None
+
+
+# Helper Function 1 : Generate Embedding
+# Texts already embedded are served from the local store; all misses go to the API in a single batched request.
+def _split_cached(input, model):
+    texts = [input] if isinstance(input, str) else list(input)
+    store = get_embedding_store()
+    if store is None:
+        return texts, store, [None] * len(texts)
+    return texts, store, store.get_many(model, texts)
+
+
+def _merge_embeddings(texts, store, vectors, miss_positions, miss_vectors, model):
+    if store is not None and miss_vectors:
+        store.put_many(model, [texts[i] for i in miss_positions], miss_vectors)
+    for position, vector in zip(miss_positions, miss_vectors):
+        vectors[position] = vector
+    return [list(map(float, v)) for v in vectors]
+
+
+def _embedding_request_key(texts, model):
+    payload = json.dumps({'model': model, 'input': texts}, ensure_ascii=False, separators=(',', ':'))
+    return 'embedding:' + hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _request_embeddings(texts, model, call_site=None):
+    def send():
+        start = time.perf_counter()
+        try:
+            response = get_client().embeddings.create(
+                input=texts,
+                model=model
+            )
+        except Exception as e:
+            _record_call(call_site, model, start, error=e)
+            raise
+        _record_call(call_site, model, start, response=response)
+        return [x.embedding for x in response.data]
+    return request_flight.do(_embedding_request_key(texts, model), send)
+
+
+async def _request_embeddings_async(texts, model, call_site=None):
+    async def send():
+        start = time.perf_counter()
+        try:
+            response = await get_async_client().embeddings.create(
+                input=texts,
+                model=model
+            )
+        except Exception as e:
+            _record_call(call_site, model, start, error=e)
+            raise
+        _record_call(call_site, model, start, response=response)
+        return [x.embedding for x in response.data]
+    return await request_flight.do_async(_embedding_request_key(texts, model), send)
+
+
+def get_embedding(input, model='text-embedding-3-small', call_site=None):
+    texts, store, vectors = _split_cached(input, model)
+    miss_positions = [i for i, v in enumerate(vectors) if v is None]
+    miss_vectors = []
+    if miss_positions:
+        miss_vectors = _request_embeddings([texts[i] for i in miss_positions], model, call_site)
+    return _merge_embeddings(texts, store, vectors, miss_positions, miss_vectors, model)
+
+
+@lru_cache(maxsize=None)
+def _embedding_encoding(model):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding('cl100k_base')
+
+
+def _pack_embedding_batches(token_counts, max_tokens, max_items):
+    # Greedily groups consecutive positions so each request stays under the token and item limits.
+    batches = []
+    current = []
+    current_tokens = 0
+    for position, tokens in enumerate(token_counts):
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_items):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(position)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
 
+# Helper Function 1b : Bulk embedding for ingestion
+# Cache misses are packed into requests under the endpoint's token and item limits and sent concurrently.
+def embed_many(texts, model='text-embedding-3-small', max_workers=EMBEDDING_MAX_WORKERS, verbose=False, call_site='embed_many'):
+    texts, store, vectors = _split_cached(texts, model)
+    miss_positions = [i for i, v in enumerate(vectors) if v is None]
+    if not miss_positions:
+        return _merge_embeddings(texts, store, vectors, [], [], model)
+
+    start = time.perf_counter()
+    encoding = _embedding_encoding(model)
+    miss_texts = [texts[i] for i in miss_positions]
+    token_counts = [len(encoding.encode(text)) for text in miss_texts]
+    batches = _pack_embedding_batches(token_counts, EMBEDDING_MAX_TOKENS_PER_REQUEST, EMBEDDING_MAX_ITEMS_PER_REQUEST)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches)))) as executor:
+        # executor.map preserves batch order, so results line up with miss_positions.
+        batch_results = executor.map(lambda batch: _request_embeddings([miss_texts[i] for i in batch], model, call_site), batches)
+        miss_vectors = [vector for result in batch_results for vector in result]
+
+    if verbose:
+        # Off by default: ingestion syncs call this through CachedOpenAIEmbeddings, and telemetry already records each request
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        total_tokens = sum(token_counts)
+        print(f'Embedded {len(miss_texts)} texts ({total_tokens} tokens) in {len(batches)} requests over {elapsed:.2f}s: '
+              f'{len(miss_texts) / elapsed:.1f} texts/s, {total_tokens / elapsed:.0f} tokens/s '
+              f'({len(texts) - len(miss_texts)} served from cache)')
+    return _merge_embeddings(texts, store, vectors, miss_positions, miss_vectors, model)
+
+
+async def get_embedding_async(input, model='text-embedding-3-small', call_site=None):
+    loop = asyncio.get_running_loop()
+    texts, store, vectors = await loop.run_in_executor(_embedding_store_executor, _split_cached, input, model)
+    miss_positions = [i for i, v in enumerate(vectors) if v is None]
+    miss_vectors = []
+    if miss_positions:
+        miss_vectors = await _request_embeddings_async([texts[i] for i in miss_positions], model, call_site)
+    return await loop.run_in_executor(
+        _embedding_store_executor, _merge_embeddings, texts, store, vectors, miss_positions, miss_vectors, model)
+
+
+# Helper Function 2 : Call out LLM
+# model and max_tokens default to the route for call_site in helper_functions/model_routing.py.
+def get_completion(prompt, model=None, temperature=0, top_p=1.0, max_tokens=None, n=1, json_output=False, call_site=None):
+    messages = [{"role": "user", "content": prompt}]
+    return get_completion_by_messages(messages, model=model, temperature=temperature, top_p=top_p,
+                                      max_tokens=max_tokens, n=n, json_output=json_output, call_site=call_site)
+
+
+async def get_completion_async(prompt, model=None, temperature=0, top_p=1.0, max_tokens=None, n=1, json_output=False, call_site=None):
     messages = [{"role": "user", "content": prompt}]
-    response = client.chat.completions.create( #originally was openai.chat.completions
-        model=model,
+    return await get_completion_by_messages_async(messages, model=model, temperature=temperature, top_p=top_p,
+                                                  max_tokens=max_tokens, n=n, json_output=json_output, call_site=call_site)
+
+
+def _completion_params(messages, model, temperature, top_p, max_tokens, json_output, call_site):
+    route = model_routing.resolve_route(call_site, model=model, max_tokens=max_tokens)
+    params = dict(
+        model=route.model,
         messages=messages,
         temperature=temperature,
         top_p=top_p,
-        max_tokens=max_tokens,
+        max_tokens=route.max_tokens,
         n=1,
-        response_format=output_json_structure,
+        response_format=_response_format(json_output),
+        timeout=route.timeout,
     )
-    return response.choices[0].message.content
+    return params, route
+
+
+def _hedge_delay(call_site, route):
+    # Seconds to wait before firing a duplicate request, or None when this call should not be hedged.
+    if not route.hedge:
+        return None
+    p95 = telemetry.latency_quantile(call_site, model_routing.HEDGE_QUANTILE, model_routing.HEDGE_MIN_SAMPLES)
+    if p95 is None:
+        return None
+    return max(p95, model_routing.HEDGE_MIN_DELAY)
+
+
+def _run_into(future, call):
+    if future.set_running_or_notify_cancel():
+        try:
+            future.set_result(call())
+        except BaseException as e:
+            future.set_exception(e)
+
+
+def _submit_hedge(call):
+    # Returns None instead of queueing when every hedge worker is busy: a duplicate that waits for a thread cannot win.
+    if not _hedge_slots.acquire(blocking=False):
+        return None
+    future = _hedge_executor.submit(call)
+    future.add_done_callback(lambda _: _hedge_slots.release())
+    return future
+
+
+def _hedged(call, delay, call_site, model):
+    # Run call(); if it has not finished after delay seconds, run a duplicate and return whichever succeeds first.
+    if delay is None:
+        return call()
+    # The primary starts at once on a thread of its own rather than in the hedge pool, so it never queues behind other
+    # requests' duplicates, and the caller stays free to return the duplicate's result if that arrives first.
+    primary = Future()
+    threading.Thread(target=_run_into, args=(primary, call), name='llm-primary', daemon=True).start()
+    done, _ = wait([primary], timeout=delay)
+    if done:
+        return primary.result()
+    duplicate = _submit_hedge(call)
+    if duplicate is None:
+        return primary.result()
+    telemetry.record_hedge(call_site, model)
+    pending = {primary, duplicate}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                # The slower request cannot be interrupted and finishes in the background; its result is dropped.
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+async def _hedged_async(make_call, delay, call_site, model):
+    if delay is None:
+        return await make_call()
+    primary = asyncio.ensure_future(make_call())
+    done, _ = await asyncio.wait({primary}, timeout=delay)
+    if done:
+        return primary.result()
+    telemetry.record_hedge(call_site, model)
+    pending = {primary, asyncio.ensure_future(make_call())}
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def _completion_key(params):
+    return make_cache_key(params['model'], params['messages'], params['temperature'], params['top_p'],
+                          params['max_tokens'], params['response_format'])
+
+
+def _cached_completion(key, params, call_site):
+    if completion_cache is None:
+        return None
+    cached = completion_cache.get(key)
+    if cached is not None:
+        telemetry.record_cache_hit(call_site, params['model'])
+    return cached
+
+
+def _create_completion(key, params, route, call_site):
+    def attempt():
+        start = time.perf_counter()
+        try:
+            response = get_client().chat.completions.create(**params)
+        except Exception as e:
+            _record_call(call_site, params['model'], start, error=e)
+            raise
+        _record_call(call_site, params['model'], start, response=response)
+        return response
+
+    def send():
+        response = _hedged(attempt, _hedge_delay(call_site, route), call_site, params['model'])
+        content = response.choices[0].message.content
+        if completion_cache is not None:
+            completion_cache.set(key, content)
+        return content
+    return request_flight.do('completion:' + key, send)
+
+
+async def _create_completion_async(key, params, route, call_site):
+    async def attempt():
+        start = time.perf_counter()
+        try:
+            response = await get_async_client().chat.completions.create(**params)
+        except Exception as e:
+            _record_call(call_site, params['model'], start, error=e)
+            raise
+        _record_call(call_site, params['model'], start, response=response)
+        return response
+
+    async def send():
+        response = await _hedged_async(attempt, _hedge_delay(call_site, route), call_site, params['model'])
+        content = response.choices[0].message.content
+        if completion_cache is not None:
+            completion_cache.set(key, content)
+        return content
+    return await request_flight.do_async('completion:' + key, send)
+
 
 # Note that this function directly take in "messages" as the parameter.
-def get_completion_by_messages(messages, model="gpt-4o-mini", temperature=0, top_p=1.0, max_tokens=1024, n=1, json_output=False):
-    if json_output == True:
-      output_json_structure = {"type": "json_object"}
-    else:
-      output_json_structure = None
+# call_site names the pipeline step for telemetry, e.g. 'initial_response'.
+def get_completion_by_messages(messages, model=None, temperature=0, top_p=1.0, max_tokens=None, n=1, json_output=False, call_site=None):
+    params, route = _completion_params(messages, model, temperature, top_p, max_tokens, json_output, call_site)
+    key = _completion_key(params)
+    cached = _cached_completion(key, params, call_site)
+    if cached is not None:
+        return cached
+    return _create_completion(key, params, route, call_site)
 
-    response = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        temperature=temperature,
-        top_p=top_p,
-        max_tokens=max_tokens,
-        n=1,
-        response_format=output_json_structure
-    )
-    return response.choices[0].message.content
 
 # Define async version of the get_completion_by_messages
-async def get_completion_by_messages_async(messages, model="gpt-4o-mini", temperature=0, top_p=1.0, max_tokens=1024, n=1, json_output=False):
-    if json_output:
-        output_json_structure = {"type": "json_object"}
-    else:
-        output_json_structure = None
-
-    response = await client.chat.completions.acreate(
-        model=model,
-        messages=messages,
-        temperature=temperature,
-        top_p=top_p,
-        max_tokens=max_tokens,
-        n=n,
-        response_format=output_json_structure
-    )
-    return response.choices[0].message.content
+async def get_completion_by_messages_async(messages, model=None, temperature=0, top_p=1.0, max_tokens=None, n=1, json_output=False, call_site=None):
+    params, route = _completion_params(messages, model, temperature, top_p, max_tokens, json_output, call_site)
+    key = _completion_key(params)
+    cached = _cached_completion(key, params, call_site)
+    if cached is not None:
+        return cached
+    return await _create_completion_async(key, params, route, call_site)
+
+
+def request_flight_stats():
+    return request_flight.stats()
+
+
+# Helper Function 2b : Streaming completion
+# Iterating the stream yields text deltas as they arrive; once exhausted, .text holds the full reply and .usage the token usage.
+# The request is only sent when iteration starts, so the stream can be created in one Streamlit run and rendered in the next.
+class CompletionStream:
+    def __init__(self, messages, model=None, temperature=0, top_p=1.0, max_tokens=None, json_output=False, call_site=None):
+        self.params, _ = _completion_params(messages, model, temperature, top_p, max_tokens, json_output, call_site)
+        self.call_site = call_site
+        # Optional callback run with the full text once the stream has been read to the end.
+        self.on_complete = None
+        # Optional callback run with the exception if the stream fails; text it returns is yielded instead of raising.
+        self.on_error = None
+        self.text = None
+        self.usage = None
+
+    def __iter__(self):
+        if self.text is not None:
+            # Already consumed, replay the final text.
+            yield self.text
+            return
+
+        key = _completion_key(self.params)
+        cached = _cached_completion(key, self.params, self.call_site)
+        if cached is not None:
+            self.text = cached
+            self._complete()
+            yield cached
+            return
+
+        # Streams are not coalesced by request_flight: each viewer needs its own token stream.
+        start = time.perf_counter()
+        ttft = None
+        parts = []
+        try:
+            stream = get_client().chat.completions.create(
+                **self.params,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            for chunk in stream:
+                if chunk.usage is not None:
+                    self.usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if ttft is None:
+                        ttft = time.perf_counter() - start
+                    delta = chunk.choices[0].delta.content
+                    parts.append(delta)
+                    yield delta
+        except Exception as e:
+            _record_call(self.call_site, self.params['model'], start, error=e, ttft=ttft)
+            fallback = self.on_error(e) if self.on_error is not None else None
+            if fallback is None:
+                raise
+            # The consumer (st.write_stream) may already have rendered part of the reply
+            yield ('\n\n' if parts else '') + fallback
+            return
+        _record_call(self.call_site, self.params['model'], start, response=self, ttft=ttft)
+        self.text = ''.join(parts)
+        if completion_cache is not None:
+            completion_cache.set(key, self.text)
+        self._complete()
+
+    def _complete(self):
+        if self.on_complete is not None:
+            self.on_complete(self.text)
+
+
+def stream_completion_by_messages(messages, model=None, temperature=0, top_p=1.0, max_tokens=None, n=1, json_output=False, call_site=None):
+    return CompletionStream(messages, model=model, temperature=temperature, top_p=top_p,
+                            max_tokens=max_tokens, json_output=json_output, call_site=call_site)
+
 
 # Helper Function 3 : Calculating the tokens given the "message"
 # ⚠️ This is simplified implementation that is good enough for a rough estimation
@@ -83,4 +598,4 @@ def count_tokens(text):
 def count_tokens_from_message(messages):
     encoding = tiktoken.encoding_for_model('gpt-4o-mini')
     value = ' '.join([x.get('content') for x in messages])
-    return len(encoding.encode(value))
\ No newline at end of file
+    return len(encoding.encode(value))
@@ -0,0 +1,49 @@
+# Per-step routing table for the LLM calls in the pipeline.
+# Each call site maps to the model, max_tokens and timeout that suit it, so that small structured steps
+# (classification, parameter extraction) run on the fastest tier with a tight token budget, while the long
+# email-drafting steps keep a larger budget. Explicit arguments passed by the caller always take precedence.
+# Steps with hedge=True may send a duplicate request once they run past the p95 latency observed for that step.
+
+import os
+from collections import namedtuple
+
+Route = namedtuple('Route', ['model', 'max_tokens', 'timeout', 'hedge'])
+
+DEFAULT_MODEL = os.getenv('LLM_DEFAULT_MODEL', 'gpt-4o-mini')
+FAST_MODEL = os.getenv('LLM_FAST_MODEL', 'gpt-4o-mini')
+
+DEFAULT_ROUTE = Route(model=DEFAULT_MODEL, max_tokens=1024, timeout=60.0, hedge=False)
+
+ROUTING_TABLE = {
+    # Tiny JSON classifier with three boolean keys.
+    'initial_response': Route(model=FAST_MODEL, max_tokens=128, timeout=15.0, hedge=True),
+    # Short list of parameter names.
+    'identify_water_quality_parameter': Route(model=FAST_MODEL, max_tokens=256, timeout=20.0, hedge=True),
+    # At most 3 sentences.
+    'water_testing_query_handler': Route(model=FAST_MODEL, max_tokens=256, timeout=20.0, hedge=True),
+    # At most 6 sentences plus subject and sign-off.
+    'rejection_response_irrelevance': Route(model=DEFAULT_MODEL, max_tokens=512, timeout=30.0, hedge=False),
+    'substantiate_water_quality_parameter': Route(model=DEFAULT_MODEL, max_tokens=512, timeout=45.0, hedge=False),
+    # Free-form answer over retrieved past emails (water_quality_query_handler_matthew.py).
+    'extract_email_information': Route(model=DEFAULT_MODEL, max_tokens=512, timeout=45.0, hedge=False),
+    'final_production_claim_response': Route(model=DEFAULT_MODEL, max_tokens=512, timeout=45.0, hedge=False),
+    'generate_response_based_on_water_quality_standards': Route(model=DEFAULT_MODEL, max_tokens=1024, timeout=60.0, hedge=False),
+    # Long consolidated reply email.
+    'response_consolidation': Route(model=DEFAULT_MODEL, max_tokens=1536, timeout=90.0, hedge=False),
+}
+
+# Hedging needs enough samples for a meaningful p95, and is never fired earlier than HEDGE_MIN_DELAY seconds.
+HEDGING_ENABLED = os.getenv('LLM_HEDGING', '1') == '1'
+HEDGE_MIN_SAMPLES = int(os.getenv('LLM_HEDGE_MIN_SAMPLES', 20))
+HEDGE_MIN_DELAY = float(os.getenv('LLM_HEDGE_MIN_DELAY', 0.5))
+HEDGE_QUANTILE = 0.95
+
+
+def resolve_route(call_site, model=None, max_tokens=None, timeout=None):
+    route = ROUTING_TABLE.get(call_site, DEFAULT_ROUTE)
+    return Route(
+        model=model or route.model,
+        max_tokens=max_tokens or route.max_tokens,
+        timeout=timeout or route.timeout,
+        hedge=route.hedge and HEDGING_ENABLED,
+    )
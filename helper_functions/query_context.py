@@ -0,0 +1,41 @@
+# Request-scoped state shared by every handler that works on the same public query.
+# The query embedding is computed lazily, at most once per model, and reused by every vector search for the request
+# (email archive in step 4 and in response consolidation, PUB FAQ in the product claim handler) instead of each search
+# embedding the same text again.
+
+import threading
+
+from helper_functions import llm
+
+
+class QueryContext:
+    def __init__(self, text, call_site='query_context'):
+        self.text = text
+        self.call_site = call_site
+        self._embeddings = {}
+        self._lock = threading.Lock()
+
+    def embedding(self, model='text-embedding-3-small'):
+        with self._lock:
+            if model not in self._embeddings:
+                self._embeddings[model] = llm.get_embedding([self.text], model=model, call_site=self.call_site)[0]
+            return self._embeddings[model]
+
+    async def aembedding(self, model='text-embedding-3-small'):
+        if model not in self._embeddings:
+            # Concurrent callers are coalesced by the single-flight in llm.get_embedding_async.
+            vector = (await llm.get_embedding_async([self.text], model=model, call_site=self.call_site))[0]
+            with self._lock:
+                self._embeddings.setdefault(model, vector)
+        return self._embeddings[model]
+
+
+def embedding_model(vectordb):
+    return getattr(vectordb.embeddings, 'model', 'text-embedding-3-small')
+
+
+def search_with_relevance_scores(vectordb, query_embedding, k=4):
+    # Same (document, relevance score) pairs as vectordb.similarity_search_with_relevance_scores, for a precomputed embedding.
+    relevance_score_fn = vectordb._select_relevance_score_fn()
+    results = vectordb.similarity_search_by_vector_with_relevance_scores(query_embedding, k=k)
+    return [(document, relevance_score_fn(score)) for document, score in results]
@@ -0,0 +1,275 @@
+# Client-side flow control for every request sent to the OpenAI API.
+# 1. RateLimiter: token buckets for requests per minute and tokens per minute.
+# 2. AdaptiveConcurrencyLimiter: AIMD limit on in-flight requests that backs off on 429s and latency spikes.
+# 3. LimitedTransport / LimitedAsyncTransport: httpx transports that apply both of the above and retry 429/5xx
+#    responses with jittered exponential backoff. Installing them on the httpx clients covers the OpenAI SDK
+#    clients in llm.py and the LangChain ChatOpenAI instances alike. An optional circuit breaker sees the outcome of
+#    every attempt, so a dead backend opens it without waiting out each request's retries and backoff.
+
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+
+import httpx
+
+RETRY_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+RETRY_EXCEPTIONS = (httpx.TimeoutException, httpx.ConnectError, httpx.RemoteProtocolError)
+
+
+class TokenBucket:
+    # Reservation-style bucket: reserve() always succeeds and returns how long the caller must wait before sending.
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.available = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount, now):
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+        self.available -= amount
+        if self.available >= 0:
+            return 0.0
+        return -self.available / self.rate
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self._lock = threading.Lock()
+
+    def reserve(self, estimated_tokens):
+        with self._lock:
+            now = time.monotonic()
+            return max(self.requests.reserve(1, now), self.tokens.reserve(estimated_tokens, now))
+
+
+class AdaptiveConcurrencyLimiter:
+    # Additive increase after a window of healthy calls, multiplicative decrease on throttling or latency spikes.
+    # Latency baselines are kept per latency key (see latency_key), so a long call is only compared with calls of its kind.
+    def __init__(self, initial_limit=8, min_limit=1, max_limit=64, backoff_factor=0.5, latency_spike_factor=3.0):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_factor = backoff_factor
+        self.latency_spike_factor = latency_spike_factor
+        self.in_flight = 0
+        self.latency_ewma = {}
+        self._condition = threading.Condition()
+
+    def try_acquire(self):
+        with self._condition:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    async def acquire_async(self):
+        while not self.try_acquire():
+            await asyncio.sleep(0.05)
+
+    def release(self, key, latency=None, throttled=False):
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self._decrease()
+            elif latency is not None:
+                baseline = self.latency_ewma.get(key)
+                if baseline is not None and latency > self.latency_spike_factor * baseline:
+                    self._decrease()
+                else:
+                    self.limit = min(self.max_limit, self.limit + 1.0 / max(self.limit, 1.0))
+                self.latency_ewma[key] = latency if baseline is None else 0.8 * baseline + 0.2 * latency
+            self._condition.notify_all()
+
+    def _decrease(self):
+        self.limit = max(self.min_limit, self.limit * self.backoff_factor)
+
+
+def backoff_delay(attempt, response=None, base=0.5, cap=30.0):
+    # Honour Retry-After when the server sends one, otherwise full-jitter exponential backoff.
+    if response is not None:
+        retry_after = response.headers.get('retry-after')
+        if retry_after:
+            try:
+                return min(cap, float(retry_after))
+            except ValueError:
+                pass
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def request_payload(request):
+    try:
+        return json.loads(request.content or b'{}')
+    except (ValueError, UnicodeDecodeError):
+        return {}
+
+
+def latency_key(request, payload):
+    # Endpoint, model and token budget. The routing table gives every call site its own budget
+    # (helper_functions/model_routing.py), so a 128-token classifier and a 1536-token consolidation keep separate baselines
+    # instead of registering as latency spikes against each other.
+    max_tokens = payload.get('max_tokens') or payload.get('max_completion_tokens')
+    return request.url.path, payload.get('model'), max_tokens
+
+
+class _LimitedTransportBase:
+    def __init__(self, rate_limiter, concurrency, estimate_tokens, max_retries, circuit_breaker):
+        self.rate_limiter = rate_limiter
+        self.concurrency = concurrency
+        self.estimate_tokens = estimate_tokens
+        self.max_retries = max_retries
+        self.circuit_breaker = circuit_breaker
+
+    def _reservation(self, payload):
+        return self.rate_limiter.reserve(self.estimate_tokens(payload))
+
+    def _before_attempt(self):
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.before_call()
+
+    def _after_attempt(self, response=None):
+        # Timeouts, transport errors and 5xx responses count against the breaker; anything else means the backend is up.
+        if self.circuit_breaker is None:
+            return
+        if response is None or response.status_code >= 500:
+            self.circuit_breaker.record_failure()
+        else:
+            self.circuit_breaker.record_success()
+
+    def _abandon_attempt(self):
+        # Cancelled (hedge loser, abandoned caller) or interrupted: says nothing about the backend, but a half-open
+        # probe must not stay marked as in flight.
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.release_probe()
+
+
+class LimitedTransport(_LimitedTransportBase, httpx.BaseTransport):
+    def __init__(self, rate_limiter, concurrency, estimate_tokens, max_retries=5, circuit_breaker=None, **transport_kwargs):
+        super().__init__(rate_limiter, concurrency, estimate_tokens, max_retries, circuit_breaker)
+        self._transport = httpx.HTTPTransport(**transport_kwargs)
+
+    def handle_request(self, request):
+        return self._send_with_retries(request)
+
+    def _send_with_retries(self, request):
+        request.read()
+        payload = request_payload(request)
+        key = latency_key(request, payload)
+        for attempt in range(self.max_retries + 1):
+            time.sleep(self._reservation(payload))
+            self._before_attempt()
+            try:
+                self.concurrency.acquire()
+            except BaseException:
+                # Interrupted while waiting for a slot: nothing was sent, but a claimed half-open probe must be handed back
+                self._abandon_attempt()
+                raise
+            start = time.monotonic()
+            response = None
+            error = None
+            try:
+                response = self._transport.handle_request(request)
+            except httpx.TransportError as e:
+                error = e
+            except BaseException:
+                self._abandon_attempt()
+                raise
+            finally:
+                # The slot is freed on every path, including cancellation and non-retryable transport errors
+                if response is not None:
+                    self.concurrency.release(key, latency=time.monotonic() - start,
+                                             throttled=response.status_code == 429)
+                else:
+                    self.concurrency.release(key, throttled=isinstance(error, RETRY_EXCEPTIONS))
+            self._after_attempt(response)
+            if error is not None:
+                if not isinstance(error, RETRY_EXCEPTIONS) or attempt == self.max_retries:
+                    raise error
+                time.sleep(backoff_delay(attempt))
+                continue
+            if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                delay = backoff_delay(attempt, response)
+                response.close()
+                time.sleep(delay)
+                continue
+            return response
+
+    def close(self):
+        self._transport.close()
+
+
+class LimitedAsyncTransport(_LimitedTransportBase, httpx.AsyncBaseTransport):
+    def __init__(self, rate_limiter, concurrency, estimate_tokens, max_retries=5, circuit_breaker=None, **transport_kwargs):
+        super().__init__(rate_limiter, concurrency, estimate_tokens, max_retries, circuit_breaker)
+        self._transport = httpx.AsyncHTTPTransport(**transport_kwargs)
+
+    async def handle_async_request(self, request):
+        return await self._send_async_with_retries(request)
+
+    async def _send_async_with_retries(self, request):
+        await request.aread()
+        payload = request_payload(request)
+        key = latency_key(request, payload)
+        for attempt in range(self.max_retries + 1):
+            await asyncio.sleep(self._reservation(payload))
+            self._before_attempt()
+            try:
+                await self.concurrency.acquire_async()
+            except BaseException:
+                # Cancelled while waiting for a slot: nothing was sent, but a claimed half-open probe must be handed back
+                self._abandon_attempt()
+                raise
+            start = time.monotonic()
+            response = None
+            error = None
+            try:
+                response = await self._transport.handle_async_request(request)
+            except httpx.TransportError as e:
+                error = e
+            except BaseException:
+                self._abandon_attempt()
+                raise
+            finally:
+                # The slot is freed on every path, including cancellation and non-retryable transport errors
+                if response is not None:
+                    self.concurrency.release(key, latency=time.monotonic() - start,
+                                             throttled=response.status_code == 429)
+                else:
+                    self.concurrency.release(key, throttled=isinstance(error, RETRY_EXCEPTIONS))
+            self._after_attempt(response)
+            if error is not None:
+                if not isinstance(error, RETRY_EXCEPTIONS) or attempt == self.max_retries:
+                    raise error
+                await asyncio.sleep(backoff_delay(attempt))
+                continue
+            if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                delay = backoff_delay(attempt, response)
+                await response.aclose()
+                await asyncio.sleep(delay)
+                continue
+            return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+# Process-wide limiters, sized from the environment to match the account's tier.
+rate_limiter = RateLimiter(
+    requests_per_minute=int(os.getenv('OPENAI_REQUESTS_PER_MINUTE', 500)),
+    tokens_per_minute=int(os.getenv('OPENAI_TOKENS_PER_MINUTE', 200000)),
+)
+concurrency_limiter = AdaptiveConcurrencyLimiter(
+    initial_limit=int(os.getenv('OPENAI_INITIAL_CONCURRENCY', 8)),
+    max_limit=int(os.getenv('OPENAI_MAX_CONCURRENCY', 64)),
+)
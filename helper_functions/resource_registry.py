@@ -0,0 +1,52 @@
+# Process-wide registry of expensive, reusable resources: embedding models, Chroma handles, chat models and QA chains.
+# Each resource is created once per process on first use and then shared by every Streamlit session and handler module.
+# Creation is serialised per key, so concurrent first requests build a resource only once while unrelated resources can
+# still be built in parallel.
+
+import threading
+
+from helper_functions.cached_embeddings import CachedOpenAIEmbeddings
+
+
+class ResourceRegistry:
+    def __init__(self):
+        self._resources = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    def get(self, key, factory):
+        # Returns the resource registered under key, calling factory() to create it if it does not exist yet.
+        if key in self._resources:
+            self.reused += 1
+            return self._resources[key]
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if key in self._resources:
+                self.reused += 1
+                return self._resources[key]
+            resource = factory()
+            self._resources[key] = resource
+            self.created += 1
+            return resource
+
+    def discard(self, key):
+        # Drops a resource, e.g. after its vector database was rebuilt on disk. The next get() creates it again.
+        with self._lock:
+            self._resources.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._resources.clear()
+
+    def stats(self):
+        return {'resources': len(self._resources), 'created': self.created, 'reused': self.reused}
+
+
+resources = ResourceRegistry()
+
+
+def get_embeddings_model(model='text-embedding-3-small'):
+    return resources.get(('embeddings', model), lambda: CachedOpenAIEmbeddings(model=model))
@@ -0,0 +1,40 @@
+# Last known good final reply per query, used as a stale fallback while the OpenAI circuit breaker is open.
+# Queries are considered equivalent when they match after case folding and whitespace normalisation.
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+
+def query_key(query):
+    normalised = re.sub(r'\s+', ' ', query).strip().casefold()
+    return hashlib.sha256(normalised.encode('utf-8')).hexdigest()
+
+
+class ResponseStore:
+    def __init__(self, path='data/cache/stale_responses.sqlite3'):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, updated REAL NOT NULL)'
+        )
+        self._conn.commit()
+
+    def put(self, query, response):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses (key, response, updated) VALUES (?, ?, ?)',
+                (query_key(query), response, time.time())
+            )
+            self._conn.commit()
+
+    def get(self, query):
+        # Returns (response, updated_timestamp) or None.
+        with self._lock:
+            return self._conn.execute(
+                'SELECT response, updated FROM responses WHERE key = ?', (query_key(query),)
+            ).fetchone()
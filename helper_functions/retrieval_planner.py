@@ -0,0 +1,67 @@
+# Single-pass retrieval for a batch of sub-queries against one Chroma vector store.
+# All sub-queries are embedded in one batched embeddings call and searched with a single Chroma query carrying every
+# query embedding, instead of one embed + search round trip per sub-query (and per retriever) as before.
+# Chunks returned for several sub-queries are stored once; each sub-query keeps its own ranked top-k list of chunk ids.
+
+import asyncio
+from functools import partial
+
+from langchain_core.documents import Document
+
+from helper_functions import llm
+
+
+class RetrievalPlan:
+    def __init__(self, queries, chunks, ranked_ids):
+        self.queries = queries
+        self.chunks = chunks            # chunk id -> Document, deduplicated across sub-queries
+        self.ranked_ids = ranked_ids    # per sub-query, chunk ids from most to least similar
+
+    def documents_for(self, position):
+        return [self.chunks[chunk_id] for chunk_id in self.ranked_ids[position]]
+
+    def stats(self):
+        retrieved = sum(len(ids) for ids in self.ranked_ids)
+        return {'queries': len(self.queries), 'retrieved': retrieved, 'unique_chunks': len(self.chunks)}
+
+
+def _query_collection(vectordb, query_embeddings, k):
+    return vectordb._collection.query(
+        query_embeddings=query_embeddings,
+        n_results=k,
+        include=['documents', 'metadatas'],
+    )
+
+
+def _build_plan(queries, result):
+    chunks = {}
+    ranked_ids = []
+    for ids, documents, metadatas in zip(result['ids'], result['documents'], result['metadatas']):
+        for chunk_id, text, metadata in zip(ids, documents, metadatas):
+            if chunk_id not in chunks:
+                chunks[chunk_id] = Document(page_content=text, metadata=metadata or {})
+        ranked_ids.append(list(dict.fromkeys(ids)))
+    return RetrievalPlan(list(queries), chunks, ranked_ids)
+
+
+def _embedding_model(vectordb):
+    # The store's own embedding model is used for the queries so that vectors are comparable.
+    return getattr(vectordb.embeddings, 'model', 'text-embedding-3-small')
+
+
+def plan_retrieval(vectordb, queries, k=10, call_site='retrieval_planner'):
+    # vectordb is a LangChain Chroma store.
+    if not queries:
+        return RetrievalPlan([], {}, [])
+    query_embeddings = llm.get_embedding(list(queries), model=_embedding_model(vectordb), call_site=call_site)
+    return _build_plan(queries, _query_collection(vectordb, query_embeddings, k))
+
+
+async def plan_retrieval_async(vectordb, queries, k=10, call_site='retrieval_planner', executor=None):
+    # The embeddings call is awaited; the Chroma query is blocking and runs on the given executor.
+    if not queries:
+        return RetrievalPlan([], {}, [])
+    query_embeddings = await llm.get_embedding_async(list(queries), model=_embedding_model(vectordb), call_site=call_site)
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(executor, partial(_query_collection, vectordb, query_embeddings, k))
+    return _build_plan(queries, result)
@@ -0,0 +1,96 @@
+# Semantic chunking with the same algorithm as langchain_experimental's SemanticChunker (percentile breakpoints,
+# buffer of one sentence on each side), split into an embedding pass and a cheap breakpoint pass.
+# - The embedding pass embeds every combined sentence of every text in one embed_documents call. With the registry's
+#   CachedOpenAIEmbeddings these vectors are served from the content-addressed store (helper_functions/embedding_cache.py)
+#   on later runs, so only new sentences reach the API.
+# - The breakpoint pass computes adjacent-sentence cosine distances and percentile thresholds with NumPy, for any number
+#   of thresholds at once. Trying another threshold reuses the analysis instead of embedding the archive again.
+
+import re
+
+import numpy as np
+from langchain_core.documents import Document
+
+SENTENCE_PATTERN = re.compile(r'(?<=[.?!])\s+')
+DEFAULT_PERCENTILE = 95     # SemanticChunker's default breakpoint_threshold_amount for 'percentile'
+
+
+def split_sentences(text):
+    return SENTENCE_PATTERN.split(text)
+
+
+def combine_sentences(sentences, buffer_size=1):
+    # Each sentence together with buffer_size neighbours on both sides, as embedded by SemanticChunker.
+    return [' '.join(sentences[max(0, i - buffer_size):i + 1 + buffer_size]) for i in range(len(sentences))]
+
+
+def adjacent_distances(embeddings):
+    # Cosine distance between each combined sentence and the next one.
+    vectors = np.asarray(embeddings, dtype=np.float64)
+    vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    return 1.0 - np.einsum('ij,ij->i', vectors[:-1], vectors[1:])
+
+
+def breakpoint_percentile(vectordb_name, default=DEFAULT_PERCENTILE):
+    # Collections are named after their threshold, e.g. email_semantic_98 -> 98th percentile.
+    match = re.search(r'_(\d{1,3})$', vectordb_name)
+    return int(match.group(1)) if match else default
+
+
+class SentenceAnalysis:
+    __slots__ = ('sentences', 'distances')
+
+    def __init__(self, sentences, distances):
+        self.sentences = sentences
+        self.distances = distances      # len(sentences) - 1 distances; empty for single-sentence texts
+
+    def breakpoints(self, percentiles):
+        # {percentile: indices of the sentences that end a chunk}, all thresholds from one np.percentile call
+        if len(self.distances) == 0:
+            return {percentile: np.empty(0, dtype=int) for percentile in percentiles}
+        thresholds = np.percentile(self.distances, list(percentiles))
+        return {percentile: np.flatnonzero(self.distances > threshold) for percentile, threshold in zip(percentiles, thresholds)}
+
+    def chunks(self, breakpoints):
+        if len(self.sentences) == 1:
+            return list(self.sentences)
+        bounds = [0, *(int(index) + 1 for index in breakpoints), len(self.sentences)]
+        return [' '.join(self.sentences[start:end]) for start, end in zip(bounds, bounds[1:]) if start < end]
+
+
+class SemanticChunking:
+    def __init__(self, embeddings_model, buffer_size=1):
+        self.embeddings_model = embeddings_model
+        self.buffer_size = buffer_size
+
+    def analyse(self, texts):
+        # One embedding pass over all texts; returns a SentenceAnalysis per text.
+        sentences_per_text = [split_sentences(text) for text in texts]
+        combined = [combine_sentences(sentences, self.buffer_size) if len(sentences) > 1 else [] for sentences in sentences_per_text]
+        flat = [sentence for text_combined in combined for sentence in text_combined]
+        embeddings = self.embeddings_model.embed_documents(flat) if flat else []
+        analyses = []
+        offset = 0
+        for sentences, text_combined in zip(sentences_per_text, combined):
+            count = len(text_combined)
+            distances = adjacent_distances(embeddings[offset:offset + count]) if count > 1 else np.empty(0)
+            analyses.append(SentenceAnalysis(sentences, distances))
+            offset += count
+        return analyses
+
+    def split_texts(self, texts, percentiles=(DEFAULT_PERCENTILE,)):
+        # {percentile: [chunks of text 0, chunks of text 1, ...]}
+        variants = {percentile: [] for percentile in percentiles}
+        for analysis in self.analyse(texts):
+            for percentile, indices in analysis.breakpoints(percentiles).items():
+                variants[percentile].append(analysis.chunks(indices))
+        return variants
+
+    def split_documents(self, documents, percentiles=(DEFAULT_PERCENTILE,)):
+        # {percentile: [Document, ...]}; each chunk keeps a copy of its source document's metadata
+        variants = self.split_texts([document.page_content for document in documents], percentiles)
+        return {
+            percentile: [Document(page_content=chunk, metadata=dict(document.metadata))
+                         for document, chunks in zip(documents, chunks_per_document) for chunk in chunks]
+            for percentile, chunks_per_document in variants.items()
+        }
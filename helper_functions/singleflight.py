@@ -0,0 +1,87 @@
+# Single-flight coalescing of identical in-flight requests.
+# The first caller for a key (the leader) does the work; callers arriving with the same key while it runs
+# (followers) wait for and share the leader's result or exception. Nothing is kept once the leader finishes.
+# Works across threads and asyncio tasks, including different event loops: followers wait on a
+# concurrent.futures.Future, which asyncio callers await through asyncio.wrap_future.
+# A leader whose task is cancelled does not pass the cancellation on: the flight is cleared and its followers retry,
+# one of them becoming the new leader.
+
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class _LeaderCancelled(Exception):
+    pass
+
+
+class SingleFlight:
+    def __init__(self):
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def _join(self, key):
+        # Returns (future, is_leader).
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = Future()
+            # Marked running so that a cancelled follower (asyncio.wrap_future cancels what it wraps) cannot cancel it
+            future.set_running_or_notify_cancel()
+            self._in_flight[key] = future
+            self.leaders += 1
+            return future, True
+
+    def _finish(self, key, future, result=None, error=None):
+        with self._lock:
+            self._in_flight.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _fail(self, key, future, error):
+        # The leader's own cancellation is not shared; followers see _LeaderCancelled and join again
+        self._finish(key, future, error=_LeaderCancelled() if isinstance(error, asyncio.CancelledError) else error)
+
+    def do(self, key, fn):
+        while True:
+            future, is_leader = self._join(key)
+            if is_leader:
+                break
+            try:
+                return future.result()
+            except _LeaderCancelled:
+                continue
+        try:
+            result = fn()
+        except BaseException as e:
+            self._fail(key, future, e)
+            raise
+        self._finish(key, future, result=result)
+        return result
+
+    async def do_async(self, key, coro_fn):
+        while True:
+            future, is_leader = self._join(key)
+            if is_leader:
+                break
+            try:
+                return await asyncio.wrap_future(future)
+            except _LeaderCancelled:
+                continue
+        try:
+            result = await coro_fn()
+        except BaseException as e:
+            self._fail(key, future, e)
+            raise
+        self._finish(key, future, result=result)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {'leaders': self.leaders, 'coalesced': self.coalesced, 'in_flight': len(self._in_flight)}
@@ -0,0 +1,57 @@
+# Persistent cache of per-parameter substantiation answers (step 3 of the water quality workflow).
+# Entries are keyed by the normalised parameter name, the version of the reference vector index and the version of the
+# prompt, so rebuilding the index or editing the prompt makes older answers unreachable instead of serving them.
+
+import os
+import sqlite3
+import threading
+import time
+
+
+def parameter_key(parameter):
+    return ' '.join(parameter.split()).casefold()
+
+
+class SubstantiationCache:
+    def __init__(self, path='data/cache/substantiation_cache.sqlite3'):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS substantiations ('
+            'parameter TEXT NOT NULL, index_version TEXT NOT NULL, prompt_version TEXT NOT NULL, '
+            'answer TEXT NOT NULL, updated REAL NOT NULL, '
+            'PRIMARY KEY (parameter, index_version, prompt_version))'
+        )
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, parameters, index_version, prompt_version):
+        # Returns {parameter: answer} for the parameters that are cached.
+        found = {}
+        with self._lock:
+            for parameter in parameters:
+                row = self._conn.execute(
+                    'SELECT answer FROM substantiations WHERE parameter = ? AND index_version = ? AND prompt_version = ?',
+                    (parameter_key(parameter), index_version, prompt_version)
+                ).fetchone()
+                if row is not None:
+                    found[parameter] = row[0]
+            self.hits += len(found)
+            self.misses += len(parameters) - len(found)
+        return found
+
+    def put(self, parameter, index_version, prompt_version, answer):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO substantiations (parameter, index_version, prompt_version, answer, updated) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (parameter_key(parameter), index_version, prompt_version, answer, time.time())
+            )
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute('SELECT COUNT(*) FROM substantiations').fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries}
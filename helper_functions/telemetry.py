@@ -0,0 +1,165 @@
+# Per-call telemetry for LLM and embedding requests.
+# Each call records its call site, model, wall time, time to first token, token usage and estimated cost.
+# Values are aggregated into in-process histograms and counters that can be exported in the Prometheus
+# text format, and the raw events can be exported as JSONL for offline analysis.
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+# USD per 1M tokens as (prompt, completion). Unknown models are costed at zero.
+MODEL_PRICING = {
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-4o': (2.50, 10.00),
+    'gpt-3.5-turbo': (0.50, 1.50),
+    'text-embedding-3-small': (0.02, 0.0),
+    'text-embedding-3-large': (0.13, 0.0),
+}
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0)
+TOKEN_BUCKETS = (16, 64, 256, 1024, 4096, 16384, 65536)
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    pricing = MODEL_PRICING.get(model)
+    if pricing is None:
+        # Dated snapshots such as gpt-4o-mini-2024-07-18 are priced like their base model.
+        pricing = next((p for name, p in MODEL_PRICING.items() if model.startswith(name + '-')), (0.0, 0.0))
+    return (prompt_tokens * pricing[0] + completion_tokens * pricing[1]) / 1_000_000
+
+
+class Histogram:
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series['counts'][i] += 1
+        series['sum'] += value
+        series['count'] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        for labels, series in sorted(self.series.items()):
+            label_text = _format_labels(labels)
+            for bound, count in zip(self.buckets, series['counts']):
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {series["count"]}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {series["sum"]}')
+            lines.append(f'{self.name}_count{{{label_text}}} {series["count"]}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.series = {}
+
+    def inc(self, labels, value=1):
+        self.series[labels] = self.series.get(labels, 0) + value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        for labels, value in sorted(self.series.items()):
+            lines.append(f'{self.name}{{{_format_labels(labels)}}} {value}')
+        return lines
+
+
+def _format_labels(labels):
+    call_site, model = labels
+    return f'call_site="{call_site}",model="{model}"'
+
+
+class Telemetry:
+    def __init__(self, max_events=10000, jsonl_path=None):
+        self._lock = threading.Lock()
+        self.events = deque(maxlen=max_events)
+        self.jsonl_path = jsonl_path
+        self.duration = Histogram('llm_call_duration_seconds', 'Wall time of LLM and embedding calls.', LATENCY_BUCKETS)
+        self.ttft = Histogram('llm_time_to_first_token_seconds', 'Time until the first token was received.', LATENCY_BUCKETS)
+        self.prompt_tokens = Histogram('llm_prompt_tokens', 'Prompt tokens per call.', TOKEN_BUCKETS)
+        self.completion_tokens = Histogram('llm_completion_tokens', 'Completion tokens per call.', TOKEN_BUCKETS)
+        self.calls = Counter('llm_calls_total', 'Calls sent to the API.')
+        self.errors = Counter('llm_call_errors_total', 'Calls that raised an error.')
+        self.cache_hits = Counter('llm_cache_hits_total', 'Calls answered from a local cache.')
+        self.cost = Counter('llm_cost_usd_total', 'Estimated spend in USD.')
+        self.hedges = Counter('llm_hedged_requests_total', 'Duplicate requests fired after the p95 latency.')
+        # Recent successful wall times per call site, used for latency quantiles (see model_routing hedging).
+        self._latencies = defaultdict(lambda: deque(maxlen=500))
+
+    def record_call(self, call_site, model, wall_time, ttft=None, prompt_tokens=0, completion_tokens=0, error=None):
+        call_site = call_site or 'unknown'
+        labels = (call_site, model)
+        cost = estimate_cost(model, prompt_tokens, completion_tokens)
+        event = {
+            'timestamp': time.time(),
+            'call_site': call_site,
+            'model': model,
+            'wall_time': round(wall_time, 4),
+            'ttft': round(ttft if ttft is not None else wall_time, 4),
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'cost_usd': cost,
+            'error': None if error is None else type(error).__name__,
+        }
+        with self._lock:
+            self.calls.inc(labels)
+            if error is not None:
+                self.errors.inc(labels)
+            self.duration.observe(labels, wall_time)
+            self.ttft.observe(labels, event['ttft'])
+            self.prompt_tokens.observe(labels, prompt_tokens)
+            self.completion_tokens.observe(labels, completion_tokens)
+            self.cost.inc(labels, cost)
+            if error is None:
+                self._latencies[call_site].append(wall_time)
+            self.events.append(event)
+            if self.jsonl_path:
+                with open(self.jsonl_path, 'a') as f:
+                    f.write(json.dumps(event) + '\n')
+
+    def record_cache_hit(self, call_site, model):
+        with self._lock:
+            self.cache_hits.inc((call_site or 'unknown', model))
+
+    def record_hedge(self, call_site, model):
+        with self._lock:
+            self.hedges.inc((call_site or 'unknown', model))
+
+    def latency_quantile(self, call_site, quantile, min_samples=1):
+        # Returns None until min_samples successful calls have been seen for the call site.
+        with self._lock:
+            samples = sorted(self._latencies.get(call_site or 'unknown', ()))
+        if len(samples) < min_samples or not samples:
+            return None
+        return samples[min(len(samples) - 1, int(quantile * len(samples)))]
+
+    def export_prometheus(self):
+        with self._lock:
+            lines = []
+            for metric in (self.duration, self.ttft, self.prompt_tokens, self.completion_tokens,
+                           self.calls, self.errors, self.cache_hits, self.cost, self.hedges):
+                lines.extend(metric.render())
+            return '\n'.join(lines) + '\n'
+
+    def export_jsonl(self, path):
+        with self._lock:
+            events = list(self.events)
+        with open(path, 'w') as f:
+            for event in events:
+                f.write(json.dumps(event) + '\n')
+        return len(events)
+
+
+# Process-wide instance. Set LLM_TELEMETRY_JSONL to also stream every event to a file as it is recorded.
+telemetry = Telemetry(jsonl_path=os.getenv('LLM_TELEMETRY_JSONL'))
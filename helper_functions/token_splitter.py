@@ -0,0 +1,111 @@
+# Token-aware recursive splitter: RecursiveCharacterTextSplitter's algorithm (separator hierarchy, separators kept at the
+# start of the next piece, chunk_size / chunk_overlap in tokens) without re-encoding every candidate piece.
+# With length_function=count_tokens every piece and every merge step encodes its text again (and looks the encoding up
+# again). Here each document is encoded once; pieces are character spans of the document and the length of a span is the
+# number of tokens that start inside it, read from a prefix sum over the token offsets.
+# Spans are cut at whitespace separators, where tiktoken token boundaries fall as well, so the counts match
+# count_tokens(piece) except for occasional off-by-one differences at the edges (dev_tools/token_splitter_benchmark.py).
+
+import re
+from functools import lru_cache
+from itertools import accumulate
+
+import tiktoken
+from langchain_text_splitters import TextSplitter
+
+
+@lru_cache(maxsize=None)
+def _encoding(model_name):
+    return tiktoken.encoding_for_model(model_name)
+
+
+class TokenOffsetTextSplitter(TextSplitter):
+    def __init__(self, separators=None, model_name='gpt-4o-mini', **kwargs):
+        super().__init__(keep_separator=True, **kwargs)
+        self._separators = separators or ["\n\n", "\n", " ", ""]
+        self._model_name = model_name
+
+    def _token_prefix(self, text):
+        # prefix[c] = number of tokens starting before character c
+        encoding = _encoding(self._model_name)
+        _, offsets = encoding.decode_with_offsets(encoding.encode(text, disallowed_special=()))
+        starts = [0] * (len(text) + 1)
+        for offset in offsets:
+            starts[offset] += 1
+        return [0, *accumulate(starts)]
+
+    def split_text(self, text):
+        prefix = self._token_prefix(text)
+        spans = self._split_spans(text, 0, len(text), self._separators, lambda start, end: prefix[end] - prefix[start])
+        return [text[start:end] for start, end in spans]
+
+    def _split_spans(self, text, start, end, separators, length):
+        # Mirrors RecursiveCharacterTextSplitter._split_text on the span [start, end) of text.
+        chunks = []
+        separator = separators[-1]
+        new_separators = []
+        for i, candidate in enumerate(separators):
+            if candidate == "":
+                separator = candidate
+                break
+            if text.find(candidate, start, end) != -1:
+                separator = candidate
+                new_separators = separators[i + 1:]
+                break
+
+        good_splits = []
+        for piece in self._pieces(text, start, end, separator):
+            if length(*piece) < self._chunk_size:
+                good_splits.append(piece)
+            else:
+                if good_splits:
+                    chunks.extend(self._merge_spans(text, good_splits, length))
+                    good_splits = []
+                if not new_separators:
+                    chunks.append(piece)
+                else:
+                    chunks.extend(self._split_spans(text, *piece, new_separators, length))
+        if good_splits:
+            chunks.extend(self._merge_spans(text, good_splits, length))
+        return chunks
+
+    @staticmethod
+    def _pieces(text, start, end, separator):
+        # Non-empty pieces of [start, end), each separator starting the piece that follows it
+        if separator == "":
+            return [(position, position + 1) for position in range(start, end)]
+        bounds = [start]
+        bounds.extend(match.start() for match in re.compile(re.escape(separator)).finditer(text, start, end) if match.start() > start)
+        bounds.append(end)
+        return [(a, b) for a, b in zip(bounds, bounds[1:]) if a < b]
+
+    def _merge_spans(self, text, splits, length):
+        # Mirrors TextSplitter._merge_splits with an empty separator; consecutive pieces are contiguous spans.
+        chunks = []
+        current = []
+        total = 0
+        for piece in splits:
+            piece_length = length(*piece)
+            if total + piece_length > self._chunk_size and current:
+                chunk = self._strip(text, current[0][0], current[-1][1])
+                if chunk is not None:
+                    chunks.append(chunk)
+                while total > self._chunk_overlap or (total + piece_length > self._chunk_size and total > 0):
+                    total -= length(*current[0])
+                    current = current[1:]
+            current.append(piece)
+            total += piece_length
+        if current:
+            chunk = self._strip(text, current[0][0], current[-1][1])
+            if chunk is not None:
+                chunks.append(chunk)
+        return chunks
+
+    def _strip(self, text, start, end):
+        # Span of text[start:end].strip() (when strip_whitespace), or None if nothing is left
+        if self._strip_whitespace:
+            while start < end and text[start].isspace():
+                start += 1
+            while end > start and text[end - 1].isspace():
+                end -= 1
+        return (start, end) if start < end else None
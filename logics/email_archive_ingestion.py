@@ -0,0 +1,195 @@
+# Incremental ingestion of the email archive (data/Queries Received and Email Responses) into its Chroma collection.
+# A manifest next to the collection (data/vectordb_<name>/ingestion_manifest.json) records, per .msg file, its size,
+# mtime, content hash and the ids of its chunks. A sync only parses, chunks and embeds new or changed files and deletes the
+# chunks of removed files, so adding a case no longer means deleting and re-embedding the whole index.
+# Chunk ids are stable per file ("<file key>:<chunk number>"), which lets a changed file replace exactly its own chunks.
+# .msg parsing (pure-Python OLE parsing, CPU-bound) runs in a process pool; parsed files come back in archive order.
+# Run from the repository root: python dev_tools/sync_email_vectordb.py [vectordb name]
+
+import hashlib
+import json
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from langchain_community.document_loaders import OutlookMessageLoader
+from langchain_community.vectorstores import Chroma
+from langchain_community.vectorstores.utils import filter_complex_metadata
+
+from helper_functions.semantic_chunking import SemanticChunking, breakpoint_percentile
+
+EMAIL_ARCHIVE_DIR = 'data/Queries Received and Email Responses'
+MANIFEST_FILENAME = 'ingestion_manifest.json'
+MANIFEST_VERSION = 1
+EMAIL_PARSE_WORKERS = int(os.getenv('EMAIL_PARSE_WORKERS', os.cpu_count() or 1))
+
+
+def file_key(filename):
+    return hashlib.sha1(filename.encode('utf-8')).hexdigest()[:16]
+
+
+def chunk_ids(filename, count):
+    key = file_key(filename)
+    return [f'{key}:{number}' for number in range(count)]
+
+
+def content_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def manifest_path(vectordb_name):
+    return os.path.join('data', 'vectordb_' + vectordb_name, MANIFEST_FILENAME)
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def save_manifest(path, manifest):
+    # Written to a temporary file first so that an interrupted sync never leaves a truncated manifest behind.
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = path + '.tmp'
+    with open(temporary, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(temporary, path)
+
+
+def archive_files(directory=EMAIL_ARCHIVE_DIR):
+    return sorted(filename for filename in os.listdir(directory) if filename.lower().endswith('.msg'))
+
+
+def plan_sync(manifest_files, directory=EMAIL_ARCHIVE_DIR):
+    # Returns (changed, removed, fingerprints). Files whose size and mtime match the manifest are not re-hashed;
+    # a touched file whose content hash is unchanged only has its fingerprint refreshed.
+    changed = []
+    fingerprints = {}
+    present = archive_files(directory)
+    for filename in present:
+        stat = os.stat(os.path.join(directory, filename))
+        entry = manifest_files.get(filename)
+        if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            fingerprints[filename] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': entry['sha256']}
+            continue
+        digest = content_hash(os.path.join(directory, filename))
+        fingerprints[filename] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': digest}
+        if entry is None or entry['sha256'] != digest:
+            changed.append(filename)
+    removed = sorted(set(manifest_files) - set(present))
+    return changed, removed, fingerprints
+
+
+def load_message(path):
+    return OutlookMessageLoader(path).load()[0]
+
+
+def _parse_message(path):
+    # Runs in a worker process; a file that fails to parse is reported instead of aborting the whole build.
+    try:
+        return load_message(path), None
+    except Exception as e:
+        return None, f'{type(e).__name__}: {e}'
+
+
+def parse_messages(paths, max_workers=EMAIL_PARSE_WORKERS, chunksize=4):
+    # Yields (path, document, error) in the order of paths, as soon as each file (and every file before it) is parsed.
+    paths = list(paths)
+    if max_workers <= 1 or len(paths) <= 1:
+        for path in paths:
+            yield (path,) + _parse_message(path)
+        return
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(paths))) as executor:
+        for path, (document, error) in zip(paths, executor.map(_parse_message, paths, chunksize=chunksize)):
+            yield path, document, error
+
+
+def _adopt_existing_chunks(vectordb, directory):
+    # Collections built before the manifest existed have random chunk ids. Their chunks are attributed to files through
+    # the 'source' metadata written by OutlookMessageLoader, so the first sync does not have to re-embed the archive.
+    existing = vectordb._collection.get(include=['metadatas'])
+    by_source = defaultdict(list)
+    for chunk_id, metadata in zip(existing['ids'], existing['metadatas']):
+        source = (metadata or {}).get('source')
+        if source:
+            by_source[os.path.basename(source.replace('\\', '/'))].append(chunk_id)
+    files = {}
+    for filename, ids in by_source.items():
+        path = os.path.join(directory, filename)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            files[filename] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': content_hash(path), 'chunk_ids': ids}
+        else:
+            vectordb.delete(ids=ids)
+    return files
+
+
+def sync_email_vectordb(vectordb, embeddings_model, vectordb_name, directory=EMAIL_ARCHIVE_DIR, max_workers=EMAIL_PARSE_WORKERS):
+    # vectordb is a LangChain Chroma store for the collection; returns a summary of what was done.
+    path = manifest_path(vectordb_name)
+    manifest = load_manifest(path)
+    if manifest is None:
+        manifest = {'version': MANIFEST_VERSION, 'collection': vectordb_name, 'files': _adopt_existing_chunks(vectordb, directory)}
+        print(f'No ingestion manifest for {vectordb_name}; adopted existing chunks of {len(manifest["files"])} files.')
+    files = manifest['files']
+
+    changed, removed, fingerprints = plan_sync(files, directory)
+    for filename in removed:
+        vectordb.delete(ids=files.pop(filename)['chunk_ids'])
+    for filename, fingerprint in fingerprints.items():
+        if filename in files and filename not in changed:
+            files[filename].update(fingerprint)
+    save_manifest(path, manifest)
+
+    # Same algorithm as SemanticChunker; the percentile comes from the collection name (email_semantic_98 -> 98)
+    text_splitter = SemanticChunking(embeddings_model)
+    percentile = breakpoint_percentile(vectordb_name)
+    chunks_added = 0
+    failed = {}
+    paths = [directory + '/' + filename for filename in changed]
+    for filename, (_, message, error) in zip(changed, parse_messages(paths, max_workers)):
+        if error is not None:
+            # Left out of the manifest (or at its previous version), so the next sync retries it
+            print(f'Skipping {filename}: {error}')
+            failed[filename] = error
+            continue
+        documents = filter_complex_metadata(text_splitter.split_documents([message], (percentile,))[percentile])
+        ids = chunk_ids(filename, len(documents))
+        previous = files.get(filename)
+        if previous is not None:
+            stale = set(previous['chunk_ids']) - set(ids)
+            if stale:
+                vectordb.delete(ids=sorted(stale))
+        if documents:
+            # Upserted, so re-running after an interruption overwrites rather than duplicates
+            vectordb._collection.upsert(
+                ids=ids,
+                documents=[document.page_content for document in documents],
+                metadatas=[document.metadata for document in documents],
+                embeddings=embeddings_model.embed_documents([document.page_content for document in documents]),
+            )
+        files[filename] = dict(fingerprints[filename], chunk_ids=ids)
+        chunks_added += len(documents)
+        # Saved after every file, so an interrupted sync resumes where it stopped
+        save_manifest(path, manifest)
+
+    summary = {'changed': len(changed) - len(failed), 'removed': len(removed), 'unchanged': len(fingerprints) - len(changed),
+               'chunks_added': chunks_added, 'failed': failed}
+    print(f'{vectordb_name} synced: {summary}')
+    return summary
+
+
+def open_email_vectordb(embeddings_model, vectordb_name):
+    return Chroma(
+        collection_name=vectordb_name,
+        embedding_function=embeddings_model,
+        persist_directory='data/vectordb_' + vectordb_name,
+    )
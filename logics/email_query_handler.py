@@ -9,17 +9,35 @@ import json
 from helper_functions import llm
 # from logics.water_quality_query_handler_matthew import process_user_message_wq, vectordb_acquire
 # from logics.water_quality_query_handler import process_user_message_wq, vectordb_acquire
-from logics.water_quality_query_handler_async import process_user_message_wq, vectordb_acquire
-from logics.product_claim_query_handler import final_production_claim_response
-
-import asyncio
-
-async def run_process_user_message_wq(public_query):
-    result = await process_user_message_wq(public_query)
+from logics.water_quality_query_handler_async import process_user_message_wq, vectordb_acquire, warm_up_wq_resources
+from logics.product_claim_query_handler import final_production_claim_response, warm_up_product_claim_resources
+from helper_functions.response_store import ResponseStore
+from helper_functions.query_context import QueryContext, embedding_model, search_with_relevance_scores
+from helper_functions.background_loop import background_loop
+
+import datetime
+
+# Last good reply per query, served (marked as stale) while the OpenAI circuit breaker is open.
+stale_responses = ResponseStore()
+
+def warm_up_resources():
+    # Called by the apps at start-up. Vectordbs, chat models and QA chains are created once per process
+    # (helper_functions/resource_registry.py), so later calls and other sessions return immediately.
+    warm_up_wq_resources()
+    warm_up_product_claim_resources()
+    # Start the shared event loop and open its async OpenAI client now rather than on the first water quality query.
+    background_loop.run(_warm_up_async_client())
+
+async def _warm_up_async_client():
+    llm.get_async_client()
+
+async def run_process_user_message_wq(public_query, query_context=None):
+    result = await process_user_message_wq(public_query, query_context)
     return result
 
-def sync_process_user_message_wq(public_query):
-    return asyncio.run(run_process_user_message_wq(public_query))
+def sync_process_user_message_wq(public_query, query_context=None):
+    # Runs on the process-wide background loop, so the async client and its connection pool are reused across emails
+    return background_loop.run(run_process_user_message_wq(public_query, query_context))
 
 def initial_response(public_query):
     # The role of this function is to take in the public_query (in the context of this script, it is the body of the email query).
@@ -65,11 +83,11 @@ def initial_response(public_query):
           'content': user_message},
     ]
 
-    query_category_result = llm.get_completion_by_messages(messages,json_output=True)
+    query_category_result = llm.get_completion_by_messages(messages,json_output=True,call_site='initial_response')
     query_category_result = json.loads(query_category_result)
     return query_category_result
 
-def intermediate_response(public_query,query_category_result):
+def intermediate_response(public_query,query_category_result,query_context=None):
     # run through the various scenarios and obtain the responses for the various scenarios.
     # pre-allocate repose items
     water_quality_response = []
@@ -79,7 +97,7 @@ def intermediate_response(public_query,query_category_result):
     if query_category_result['water quality']:
         # pass into water_quality_handler.py
         print('True for water_quality testing category')
-        water_quality_response = sync_process_user_message_wq(public_query)       
+        water_quality_response = sync_process_user_message_wq(public_query, query_context)
 
     if query_category_result['water testing request']:
         print('True for water testing request')
@@ -87,7 +105,7 @@ def intermediate_response(public_query,query_category_result):
 
     if query_category_result['product claim']:
         print('True for product claim query')
-        product_claim_response = final_production_claim_response(public_query)
+        product_claim_response = final_production_claim_response(public_query, query_context)
         
     return water_quality_response, water_testing_response, product_claim_response
 
@@ -125,14 +143,16 @@ def water_testing_query_handler(public_query):
           'content': user_message},
     ]
 
-    water_testing_query_response = llm.get_completion_by_messages(messages)
+    water_testing_query_response = llm.get_completion_by_messages(messages,call_site='water_testing_query_handler')
     return water_testing_query_response
 
-def response_consolidation(query_category,water_quality_response, water_testing_response, product_claim_response,public_query,email_elements):
+def response_consolidation(query_category,water_quality_response, water_testing_response, product_claim_response,public_query,email_elements,stream=False,query_context=None):
     print('Individual queries completed. Now consolidating...')
     # Check for presence of vectordb
     vectordb = vectordb_acquire("email_semantic_98")
-    email_reference = vectordb.similarity_search_with_relevance_scores(public_query, k=4)
+    # Reuses the query embedding already computed for step 4 of the water quality workflow
+    query_context = query_context or QueryContext(public_query)
+    email_reference = search_with_relevance_scores(vectordb, query_context.embedding(embedding_model(vectordb)), k=4)
 
     delimiter = "###"
     system_message = f"""
@@ -170,11 +190,15 @@ def response_consolidation(query_category,water_quality_response, water_testing_
         },
     ]
 
-    final_email_reply = llm.get_completion_by_messages(messages)
+    if stream:
+        # Return the token stream so that the page can render the reply as it is generated.
+        return llm.stream_completion_by_messages(messages,call_site='response_consolidation')
+
+    final_email_reply = llm.get_completion_by_messages(messages,call_site='response_consolidation')
     print('Consolidation complete!')
     return final_email_reply
 
-def rejection_response_irrelevance(public_query,email_elements):
+def rejection_response_irrelevance(public_query,email_elements,stream=False):
     # This query serves as a simple branch to summarize the public query and indicate that it is not relevant for use case of the bot.
     delimiter = "###"
     system_message = f"""
@@ -206,19 +230,54 @@ def rejection_response_irrelevance(public_query,email_elements):
             },
     ]
 
-    rejection_response = llm.get_completion_by_messages(messages)
+    if stream:
+        return llm.stream_completion_by_messages(messages,call_site='rejection_response_irrelevance')
+
+    rejection_response = llm.get_completion_by_messages(messages,call_site='rejection_response_irrelevance')
     return rejection_response
 
-def full_workflow(public_query, email_elements):
-    
+def stale_response_fallback(public_query):
+    stored = stale_responses.get(public_query)
+    if stored is None:
+        return ("**The AI service is currently unavailable** and no earlier response to this query is on record. "
+                "Please try again in a few minutes.")
+    response, updated = stored
+    generated_on = datetime.datetime.fromtimestamp(updated).strftime('%d %b %Y %H:%M')
+    return (f"**[Stale response]** The AI service is currently unavailable. The reply below was generated on "
+            f"{generated_on} for an equivalent query and may be out of date.\n\n{response}")
+
+def run_full_workflow(public_query, email_elements, stream=False):
+    # One context per request: the query is embedded at most once for all vector searches below
+    query_context = QueryContext(public_query)
     query_category = initial_response(public_query)
 
     # Insert check to see that JSON response has at least 1 True value.
     if not any(query_category.values()):
-        final_response = rejection_response_irrelevance(public_query,email_elements)
+        final_response = rejection_response_irrelevance(public_query,email_elements,stream=stream)
         return final_response
     else:
-        water_quality_response, water_testing_response, product_claim_response = intermediate_response(public_query,query_category)
+        water_quality_response, water_testing_response, product_claim_response = intermediate_response(public_query,query_category,query_context)
 
-    final_response = response_consolidation(query_category,water_quality_response, water_testing_response, product_claim_response,public_query,email_elements)
+    final_response = response_consolidation(query_category,water_quality_response, water_testing_response, product_claim_response,public_query,email_elements,stream=stream,query_context=query_context)
+    return final_response
+
+def full_workflow(public_query, email_elements, stream=False):
+    # With stream=True the final step returns an llm.CompletionStream instead of the finished reply.
+    # While the OpenAI backend is failing, fail fast and serve the last good reply for an equivalent query instead.
+    if llm.backend_breaker.is_open():
+        return stale_response_fallback(public_query)
+    try:
+        final_response = run_full_workflow(public_query, email_elements, stream=stream)
+    except Exception:
+        if llm.backend_breaker.is_open():
+            return stale_response_fallback(public_query)
+        raise
+
+    if isinstance(final_response, llm.CompletionStream):
+        final_response.on_complete = lambda text: stale_responses.put(public_query, text)
+        # The stream is only read by the page (st.write_stream), after this function has returned. As above, only a failing
+        # backend falls back; any other error is re-raised by the stream.
+        final_response.on_error = lambda error: stale_response_fallback(public_query) if llm.backend_breaker.is_open() else None
+    else:
+        stale_responses.put(public_query, final_response)
     return final_response
@@ -6,7 +6,9 @@ import time
 from bs4 import BeautifulSoup
 import os
 from langchain.chains import RetrievalQA
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+from helper_functions.langchain_models import get_chat_model
+from helper_functions.resource_registry import resources, get_embeddings_model
+from helper_functions.query_context import QueryContext, embedding_model
 from langchain_community.vectorstores import Chroma
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain.prompts import ChatPromptTemplate, SystemMessagePromptTemplate, HumanMessagePromptTemplate, PromptTemplate
@@ -61,7 +63,7 @@ def create_pub_faq_vectordb():
     with open("data\\pub_site_faq.json", "r") as f:
         pub_faq = json.load(f)
 
-    embeddings_model = OpenAIEmbeddings(model = 'text-embedding-3-small',show_progress_bar=True)
+    embeddings_model = get_embeddings_model('text-embedding-3-small')
     text_splitter = RecursiveCharacterTextSplitter(chunk_size = 300, chunk_overlap = 50)
     vectordb = Chroma(
         collection_name= "PUB_FAQ_collection",
@@ -69,6 +71,9 @@ def create_pub_faq_vectordb():
         persist_directory='data/PUB_FAQ_collection'
             )
 
+    all_chunks = []
+    all_metadatas = []
+    all_ids = []
     for entry in pub_faq:
         url = entry["url"]
         sections = entry["sections"]
@@ -77,21 +82,46 @@ def create_pub_faq_vectordb():
         full_texts = " ".join(sections)       
         split_texts = text_splitter.split_text(full_texts)
 
-        # embed each chunk and generate embedding, next store it in the ChromaDB.
+        # collect the chunks so that every chunk is embedded in one bulk call below
         for idx, chunk in enumerate(split_texts):
-            document_id = f"{url}#chunk-{idx + 1}"
-            vectordb.add_texts(
-                texts=[chunk],
-                metadatas=[{"url":url}],
-                ids = [document_id]
-            )            
+            all_chunks.append(chunk)
+            all_metadatas.append({"url":url})
+            all_ids.append(f"{url}#chunk-{idx + 1}")
+
+    # embed all chunks through the token-aware bulk embedding path, next store them in the ChromaDB.
+    if all_chunks:
+        vectordb.add_texts(
+            texts=all_chunks,
+            metadatas=all_metadatas,
+            ids=all_ids
+        )
     print(f'Vector data base created with number of chunks = {vectordb._collection.count()}')
     return vectordb
 
-def final_production_claim_response(public_query):
+# as_retriever(k=10) never set k, so the chain has always been answering from the retriever default of 4 documents
+PRODUCT_CLAIM_TOP_K = 4
+
+# Opens the PUB FAQ vectordb and builds the chain ahead of the first query
+def warm_up_product_claim_resources():
+    resources.get(('qa_chain', 'final_production_claim_response'), _build_product_claim_chain)
+
+def final_production_claim_response(public_query, query_context=None):
+    # The vectordb and the chain are built on first use and shared by all sessions through the resource registry
+    qa_chain2 = resources.get(('qa_chain', 'final_production_claim_response'), _build_product_claim_chain)
+    vector_store = resources.get(('vectordb', 'PUB_FAQ_collection'), _load_pub_faq_vectordb)
+
+    # Retrieve with the request's shared query embedding, then run the chain's prompt and model on those documents
+    query_context = query_context or QueryContext(public_query)
+    documents = vector_store.similarity_search_by_vector(query_context.embedding(embedding_model(vector_store)), k=PRODUCT_CLAIM_TOP_K)
+    response = qa_chain2.combine_documents_chain.invoke({"input_documents": documents, "question": public_query})
+    product_claim_query_response = response["output_text"]
+
+    return product_claim_query_response
+
+def _load_pub_faq_vectordb():
 
     # Create embeddings model
-    embeddings_model = OpenAIEmbeddings(model = 'text-embedding-3-small',show_progress_bar=True)    
+    embeddings_model = get_embeddings_model('text-embedding-3-small')    
     # check for presence of vectordb
     if os.path.exists('data\\PUB_FAQ_collection'):
         print('PUB FAQ vectordb file found. Proceeding to load...')
@@ -117,9 +147,13 @@ def final_production_claim_response(public_query):
             print('PUB FAQ JSON file not found. Proceeding with creation through website scrapping')
             create_pub_faq_json()    
         vector_store = create_pub_faq_vectordb() 
+    return vector_store
+
+def _build_product_claim_chain():
+    vector_store = resources.get(('vectordb', 'PUB_FAQ_collection'), _load_pub_faq_vectordb)
 
     # Proceeding to create RetrievalQA
-    llm = ChatOpenAI(model='gpt-4o-mini', temperature=0, seed=42)
+    llm = get_chat_model(temperature=0, seed=42, call_site='final_production_claim_response')
 
     # Build prompt
     # delimiter = "###"
@@ -151,14 +185,10 @@ def final_production_claim_response(public_query):
     Helpful Answer:"""
     QA_CHAIN_PROMPT = PromptTemplate.from_template(template)
 
-    # Run chain
-    qa_chain2 = RetrievalQA.from_chain_type(
-        ChatOpenAI(model='gpt-4o-mini'),
+    # Build chain
+    return RetrievalQA.from_chain_type(
+        get_chat_model(call_site='final_production_claim_response'),
         retriever=vector_store.as_retriever(k=10),
         return_source_documents=True, # Make inspection of document possible in debug
         chain_type_kwargs={"prompt": QA_CHAIN_PROMPT}
     )
-    response = qa_chain2.invoke(public_query)
-    product_claim_query_response = response["result"]
-
-    return product_claim_query_response
@@ -0,0 +1,205 @@
+# Deterministic compliance check for readings quoted in a query ("my test kit shows 1.2 mg/L chlorine").
+# At load time the PUB range and the WHO 2022 / EPH 2019 limits of every catalog row are parsed into numeric intervals in the
+# row's unit ("<5", "81-587", "max 5", "1000 (at 25?C) (COP)"). At query time value + unit mentions are extracted, converted to
+# the row's unit and compared against those intervals. The verdicts are passed to the response prompt as facts, so the LLM no
+# longer does the arithmetic itself.
+# Only numbers with an explicit unit count as readings, plus a bare number right after the name of a unitless parameter
+# ("pH 8.9"). Case, phone and address numbers, ages and counts are never read as measurements.
+
+import re
+
+from logics.water_quality_parameter_catalog import parameter_catalog
+
+# Factors to a common base per unit family; units outside these families are only comparable when they match exactly.
+UNIT_FACTORS = {
+    'g/l': ('mass', 1e3), 'mg/l': ('mass', 1.0), 'ppm': ('mass', 1.0),
+    'ug/l': ('mass', 1e-3), 'µg/l': ('mass', 1e-3), 'μg/l': ('mass', 1e-3), '\x91g/l': ('mass', 1e-3), 'ppb': ('mass', 1e-3),
+    'ng/ml': ('mass', 1e-3), 'ng/l': ('mass', 1e-6), 'ppt': ('mass', 1e-6), 'pg/l': ('mass', 1e-9),
+    'ms/cm': ('conductivity', 1e3), 'us/cm': ('conductivity', 1.0), 'µs/cm': ('conductivity', 1.0), 'μs/cm': ('conductivity', 1.0),
+}
+DIMENSIONLESS_UNITS = {'units', '-', ''}
+UNIT_LABELS = {'ug/l': 'ug/L', 'µg/l': 'ug/L', 'μg/l': 'ug/L', '\x91g/l': 'ug/L'}
+
+_UNIT_PATTERN = (r'mg/l|mg/litre|ug/l|µg/l|μg/l|ng/l|ng/ml|pg/l|g/l|ppm|ppb|ppt|'
+                 r'ms/cm|us/cm|µs/cm|μs/cm|ntu|cfu/100\s?ml|cfu/ml|bq/l|hazen')
+# A number followed by a unit. Digits that belong to names such as "1,2-Dichloroethane" or "2,4-D" are skipped, and so is the
+# tail of a digit run such as "9123 4567".
+_READING_PATTERN = re.compile(
+    rf'(?<![\w.,\-/#])(?<!\d )(\d+(?:\.\d+)?)(?![\d,\-]|\.\d)\s*({_UNIT_PATTERN})(?![\w/])', re.IGNORECASE)
+# Numbers labelled as identifiers ("case 12 mg", "Ref: 5 ppm", "Blk 20", "tel 6 ...") are not readings.
+_IDENTIFIER_BEFORE_PATTERN = re.compile(
+    r'\b(case|ref|reference|ticket|no|number|tel|phone|mobile|hp|fax|blk|block|unit|postal|s)\W*$', re.IGNORECASE)
+# Words allowed between a unitless parameter's name and its value: "pH 8.9", "pH: 8.9", "pH level is 8.9", "pH of 8.9".
+_UNITLESS_VALUE_PATTERN = (r'(?:\s+(?:level|value|reading))?\s*(?:(?:is|was|of|at|around|about)\s+|[:=]\s*)?'
+                           r'(\d{1,3}(?:\.\d+)?)(?![\d,\-]|\.\d|\s*\d)')
+_LIMIT_PATTERN = re.compile(r'^(max\.?|<=|≤|<|>=|≥|>)?\s*(\d+(?:\.\d+)?)(?:\s*(?:-|–|to)\s*(?:<\s*)?(\d+(?:\.\d+)?))?',
+                            re.IGNORECASE)
+# Clause boundaries for pairing readings with the parameters named next to them; decimal points are not boundaries.
+_CLAUSE_PATTERN = re.compile(r'[;\n]|,(?!\d)|\.(?!\d)|\band\b|\bwhile\b|\bbut\b', re.IGNORECASE)
+
+
+def normalise_unit(unit):
+    unit = ' '.join(unit.split()).lower().replace('litre', 'l')
+    return unit.replace(' ', '') if '/' in unit else unit
+
+
+class Interval:
+    __slots__ = ('low', 'high', 'text')
+
+    def __init__(self, low, high, text):
+        self.low = low      # None when there is no lower bound
+        self.high = high    # None when there is no upper bound
+        self.text = text    # the catalog string it was parsed from
+
+    def contains(self, value):
+        return (self.low is None or value >= self.low) and (self.high is None or value <= self.high)
+
+    def describe(self, unit):
+        unit = '' if normalise_unit(unit) in DIMENSIONLESS_UNITS else f' {unit}'
+        if self.low is not None and self.high is not None:
+            return f'{self.low:g} to {self.high:g}{unit}'
+        if self.high is not None:
+            return f'at most {self.high:g}{unit}'
+        return f'at least {self.low:g}{unit}'
+
+
+def parse_interval(text, single_value_is_maximum=True):
+    # Notes in brackets are dropped; only the leading expression is used, e.g. "max 5 (COP)\nmax 1 (WW's outlet)" -> max 5.
+    base = ' '.join(re.sub(r'\([^)]*\)', ' ', text).split())
+    match = _LIMIT_PATTERN.match(base)
+    if not match:
+        return None
+    operator, first, second = match.groups()
+    operator = (operator or '').lower()
+    if second is not None:
+        # "< 0.5 - 1.2": the lower end is below the detection limit
+        return Interval(0.0 if operator.startswith('<') else float(first), float(second), text)
+    if operator in ('>', '>=', '≥'):
+        return Interval(float(first), None, text)
+    if operator or single_value_is_maximum:
+        return Interval(None, float(first), text)
+    return None
+
+
+class ParameterLimits:
+    __slots__ = ('name', 'unit', 'limits', 'unitless_reading')
+
+    def __init__(self, name, unit, limits):
+        self.name = name
+        self.unit = unit        # catalog unit as written, e.g. 'mg/L'
+        self.limits = limits    # ((authority, Interval), ...)
+        # Bare values are only read right after the exact (case-sensitive) name of a unitless parameter, so "Ph: 9123" is not pH
+        self.unitless_reading = None
+        if normalise_unit(unit) in DIMENSIONLESS_UNITS:
+            self.unitless_reading = re.compile(rf'(?<![A-Za-z0-9]){re.escape(name.strip())}(?![A-Za-z0-9]){_UNITLESS_VALUE_PATTERN}')
+
+
+class ComplianceEngine:
+    def __init__(self, catalog):
+        columns = catalog.columns
+        units_position = catalog.units_position
+        positions = (
+            ('PUB typical range', columns.index('PUB Drinking Water Standard Range')),
+            ('WHO 2022 guideline', next(i for i, c in enumerate(columns) if c.startswith('WHO'))),
+            ('EPH 2019 regulation', next(i for i, c in enumerate(columns) if c.startswith('Environmental Public Health'))),
+        )
+        self.catalog = catalog
+        self.by_name = {}
+        for record in catalog.records:
+            limits = []
+            for authority, position in positions:
+                # PUB publishes measured ranges, so a single PUB value (e.g. "< 0.005") is a detection limit, not a maximum
+                interval = parse_interval(record.values[position], single_value_is_maximum=authority != 'PUB typical range')
+                if interval is not None:
+                    limits.append((authority, interval))
+            if limits and record.name not in self.by_name:
+                self.by_name[record.name] = ParameterLimits(record.name, record.values[units_position].strip(), tuple(limits))
+
+    def extract_readings(self, text):
+        # [(position, value, unit)] for numbers with an explicit unit, in order of appearance
+        return [(match.start(), float(match.group(1)), match.group(2)) for match in _READING_PATTERN.finditer(text)
+                if not _IDENTIFIER_BEFORE_PATTERN.search(text, 0, match.start())]
+
+    def pair_readings(self, user_message, parameters):
+        # Readings are paired with the parameter named in the same clause. With one parameter, readings in clauses that name
+        # no parameter belong to it. A clause that names any other parameter, even only ambiguously, gives no readings at all.
+        parameters = [parameter for parameter in parameters if parameter in self.by_name]
+        if not parameters:
+            return []
+        pairs = []
+        for parameter in parameters:
+            pattern = self.by_name[parameter].unitless_reading
+            if pattern is not None:
+                pairs.extend((match.start(1), parameter, float(match.group(1)), None) for match in pattern.finditer(user_message))
+        for offset, clause in _clauses(user_message):
+            readings = self.extract_readings(clause)
+            if not readings:
+                continue
+            mentions = [[p for p in names if p in parameters] for names in self.catalog.matcher.mentions(clause)]
+            if not all(mentions):
+                continue
+            named = list(dict.fromkeys(p for names in mentions for p in names))
+            if not mentions and len(parameters) == 1:
+                named = parameters
+            if len(named) == 1:
+                pairs.extend((offset + position, named[0], value, unit) for position, value, unit in readings)
+            elif len(named) == len(readings):
+                pairs.extend((offset + position, parameter, value, unit)
+                             for parameter, (position, value, unit) in zip(named, readings))
+        return [(parameter, value, unit) for _, parameter, value, unit in sorted(pairs, key=lambda pair: pair[0])]
+
+    def evaluate(self, parameter, value, unit=None):
+        limits = self.by_name.get(parameter)
+        if limits is None:
+            return None
+        converted, note = self._convert(value, unit, limits.unit)
+        if converted is None and unit is None:
+            return None
+        if converted is None:
+            return f'{parameter.strip()}: reading of {value:g} {unit} cannot be compared with limits in {limits.unit}.'
+        verdicts = []
+        for authority, interval in limits.limits:
+            if interval.contains(converted):
+                verdict = 'within'
+            elif interval.high is not None and converted > interval.high:
+                verdict = 'above'
+            else:
+                verdict = 'below'
+            verdicts.append(f'{verdict} the {authority} ({interval.describe(limits.unit)})')
+        reading = f'{converted:g} {limits.unit}' if normalise_unit(limits.unit) not in DIMENSIONLESS_UNITS else f'{converted:g}'
+        return f'{parameter.strip()}: reading of {reading}{note} is ' + '; '.join(verdicts) + '.'
+
+    def _convert(self, value, unit, target_unit):
+        target = normalise_unit(target_unit)
+        if unit is None:
+            # Bare values are only taken for unitless parameters; no unit is ever assumed for the others
+            return (value, '') if target in DIMENSIONLESS_UNITS else (None, '')
+        source = normalise_unit(unit)
+        if source == target:
+            return value, ''
+        source_family, source_factor = UNIT_FACTORS.get(source, (None, None))
+        target_family, target_factor = UNIT_FACTORS.get(target, (None, None))
+        if source_family is None or source_family != target_family:
+            return None, ''
+        return value * source_factor / target_factor, f' (converted from {value:g} {UNIT_LABELS.get(source, unit)})'
+
+    def compliance_facts(self, user_message, parameters):
+        # One line per reading, or '' when the query quotes no comparable readings.
+        lines = []
+        for parameter, value, unit in self.pair_readings(user_message, parameters):
+            line = self.evaluate(parameter, value, unit)
+            if line and line not in lines:
+                lines.append(line)
+        return '\n'.join(lines)
+
+
+def _clauses(text):
+    # (offset, clause) pieces of text between clause boundaries
+    start = 0
+    for boundary in _CLAUSE_PATTERN.finditer(text):
+        yield start, text[start:boundary.start()]
+        start = boundary.end()
+    yield start, text[start:]
+
+
+compliance_engine = ComplianceEngine(parameter_catalog)
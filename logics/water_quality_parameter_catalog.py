@@ -0,0 +1,96 @@
+# Shared catalog of the consolidated water quality parameters, loaded once per process.
+# Each CSV row becomes a ParameterRecord holding its markdown table row, rendered at load time, so that
+# get_water_quality_guidelines only has to look records up and join strings: no pandas on the request path.
+# The water quality handlers share the module-level `parameter_catalog` instead of each reading the CSV.
+
+import csv
+import threading
+
+from logics.water_quality_parameter_matcher import ParameterMatcher, normalise
+
+WQ_PARAMETERS_CSV = 'data/utf8_Consolidated WQ Parameters.csv'
+
+# Regulatory columns, matched by the start of the column header, with the label used when quoting them.
+REGULATORY_COLUMNS = (
+    ('WHO', 'WHO Drinking-water Guidelines 2022'),
+    ('Environmental Public Health', 'EPH (Water Suitable for Drinking) Regulations 2019'),
+    ('US EPA', 'US EPA Standards'),
+    ('EU Directive', 'EU Directive (2020/2184)'),
+)
+
+
+class ParameterRecord:
+    __slots__ = ('index', 'name', 'values', 'markdown', 'regulatory')
+
+    def __init__(self, index, name, values, markdown, regulatory):
+        self.index = index            # row number in the CSV, kept as the first table column like DataFrame.to_markdown()
+        self.name = name              # 'Parameter List' value exactly as in the CSV
+        self.values = values          # tuple of all column values, '' where the CSV cell is empty
+        self.markdown = markdown      # '| index | value | ... |'
+        self.regulatory = regulatory  # ((label, value), ...) for the populated regulatory columns
+
+
+def _markdown_row(cells):
+    return '| ' + ' | '.join(cell.replace('|', '\\|').replace('\n', ' ') for cell in cells) + ' |'
+
+
+class ParameterCatalog:
+    def __init__(self, path=WQ_PARAMETERS_CSV):
+        with open(path, newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            self.columns = tuple(next(reader))
+            rows = [tuple(cell.strip() if i else cell for i, cell in enumerate(row)) for row in reader]
+
+        self.header = _markdown_row(('',) + self.columns) + '\n' + '|---:|' + ':---|' * len(self.columns)
+        self.parameter_list = [row[0] for row in rows]
+        self.units_position = self.columns.index('Units')
+        regulatory_positions = [
+            (next(i for i, column in enumerate(self.columns) if column.startswith(prefix)), label)
+            for prefix, label in REGULATORY_COLUMNS
+        ]
+        self.records = []
+        self.by_key = {}
+        for index, row in enumerate(rows):
+            regulatory = tuple((label, ' '.join(row[position].split())) for position, label in regulatory_positions if row[position])
+            record = ParameterRecord(index, row[0], row, _markdown_row((str(index),) + row), regulatory)
+            self.records.append(record)
+            # A few parameters (e.g. Diazinon, Mirex) appear on more than one row; all rows are kept, as isin() did.
+            self.by_key.setdefault(normalise(row[0]), []).append(record)
+        self._matcher = None
+        self._matcher_lock = threading.Lock()
+
+    @property
+    def matcher(self):
+        # Built on first use; shared by every handler module.
+        if self._matcher is None:
+            with self._matcher_lock:
+                if self._matcher is None:
+                    self._matcher = ParameterMatcher(self.parameter_list)
+        return self._matcher
+
+    def lookup(self, parameters):
+        # Records for the given names in CSV order. Names are matched after normalisation, so 'chromium' finds 'Chromium '.
+        found = {}
+        for parameter in parameters:
+            for record in self.by_key.get(normalise(parameter), ()):
+                found[record.index] = record
+        return [found[index] for index in sorted(found)]
+
+    def regulatory_summary(self, parameter):
+        # Guideline values quoted from the regulatory columns, or None when all of them are empty for this parameter.
+        lines = []
+        for record in self.lookup([parameter]):
+            units = record.values[self.units_position]
+            for label, value in record.regulatory:
+                # Units only follow numeric limits, not notes such as "Unlikely to occur in drinking-water"
+                line = f'{label}: {value}' + (f' ({units})' if units and any(c.isdigit() for c in value) else '')
+                if line not in lines:
+                    lines.append(line)
+        return '; '.join(lines) or None
+
+    def to_markdown(self, parameters):
+        records = self.lookup(parameters)
+        return '\n'.join([self.header] + [record.markdown for record in records])
+
+
+parameter_catalog = ParameterCatalog()
@@ -0,0 +1,294 @@
+# Local identification of water quality parameters in a query.
+# Replaces the LLM round trip in identify_water_quality_parameter for the common case where the query names a parameter.
+#
+# Built once from the 'Parameter List' column:
+# 1. Every parameter name, its name without qualifiers in brackets and any alias in brackets (e.g. "Total Dissolved Solids (TDS)")
+#    is normalised (lower case, punctuation to spaces) and loaded into an Aho-Corasick automaton together with a curated
+#    synonym table ("chloramine", "PFAS", "hardness", ...). Patterns are padded with spaces so they only match whole words.
+# 2. Acronyms and chemical formulas ("TDS", "F-", "NH2Cl", "Pb") are matched case-sensitively with a single compiled regex,
+#    since lower-casing them would collide with ordinary words.
+# Words that are also common English ("lead", "tin", "iron"), short acronyms ("DOC", "COD", "MX") and element symbols ("Cu", "Ni")
+# only count as a confident match when water quality context or a value follows or precedes them. "pH" must also be spelt
+# exactly so, which keeps "Ph:" or "Tel/Ph" in a signature out. When no confident match is found the caller falls back to the LLM.
+
+import re
+from collections import deque
+
+# Synonyms and lay terms, already normalised, mapped to one or more names in the 'Parameter List' column (stripped).
+SYNONYMS = {
+    'chloramine': ['Monochloramine'],
+    'chloramines': ['Monochloramine'],
+    'chlorine': ['Chlorine (Free)', 'Total Residual Chlorine'],
+    'residual chlorine': ['Total Residual Chlorine'],
+    'chlorination': ['Chlorine (Free)', 'Total Residual Chlorine'],
+    'fluorine': ['Fluoride'],
+    'fluoridation': ['Fluoride'],
+    'fluoridated': ['Fluoride'],
+    'pfas': ['Perfluorooctane Sulfonate (PFOS)', 'Perfluorooctanoic Acid (PFOA)'],
+    'pfos': ['Perfluorooctane Sulfonate (PFOS)'],
+    'pfoa': ['Perfluorooctanoic Acid (PFOA)'],
+    'forever chemicals': ['Perfluorooctane Sulfonate (PFOS)', 'Perfluorooctanoic Acid (PFOA)'],
+    'perfluoroalkyl': ['Perfluorooctane Sulfonate (PFOS)', 'Perfluorooctanoic Acid (PFOA)'],
+    'polyfluoroalkyl': ['Perfluorooctane Sulfonate (PFOS)', 'Perfluorooctanoic Acid (PFOA)'],
+    'hardness': ['Total Hardness (as CaCO3)'],
+    'gh': ['Total Hardness (as CaCO3)'],
+    'alkalinity': ['Total Alkalinity (as CaCO3)'],
+    'tds': ['Total Dissolved Solids (TDS)'],
+    'total dissolved solid': ['Total Dissolved Solids (TDS)'],
+    'e coli': ['Escherichia coli (E. coli)'],
+    'ecoli': ['Escherichia coli (E. coli)'],
+    'coliform': ['Total coliform'],
+    'coliforms': ['Total coliform'],
+    'estrogen': ['Total Estrogens'],
+    'estrogens': ['Total Estrogens'],
+    'oestrogen': ['Total Estrogens'],
+    'hormone': ['Total Estrogens'],
+    'hormones': ['Total Estrogens'],
+    'trihalomethane': ['Total Trihalomethanes (TTHM)'],
+    'trihalomethanes': ['Total Trihalomethanes (TTHM)'],
+    'thm': ['Total Trihalomethanes (TTHM)'],
+    'thms': ['Total Trihalomethanes (TTHM)'],
+    'radioactive': ['Gross Alpha', 'Gross Beta'],
+    'radioactivity': ['Gross Alpha', 'Gross Beta'],
+    'odour': ['Threshold Odour Test'],
+    'odor': ['Threshold Odour Test'],
+    'smell': ['Threshold Odour Test'],
+    'color': ['Colour'],
+    'aluminum': ['Aluminium'],
+    'sulfate': ['Sulphate'],
+    'sulfide': ['Sulphide'],
+    'phosphorus': ['Total Phosphorous (as P)'],
+    'phosphate': ['Total Phosphorous (as P)'],
+    'ammonia': ['Ammonia (as N)'],
+    'nitrate': ['Nitrate (as N)'],
+    'nitrite': ['Nitrite (as N)'],
+    'silica': ['Silica (as SiO2)'],
+    'resistivity': ['Conductivity'],
+    'algae': ['Algae Counts (Microscopy)'],
+    'algal': ['Algae Counts (Microscopy)'],
+    'pesticide': ['Pesticide residues'],
+    'pesticides': ['Pesticide residues'],
+    'chromium': ['Chromium'],
+    'hexavalent chromium': ['Hexavalent Chromium (as Cr)'],
+    'xylene': ['Xylenes (Total)'],
+    'trichloroethylene': ['Trichloroethene (Trichlorethylene)'],
+    'tetrachloroethylene': ['Tetrachloroethene (Tetrachlorethylene)'],
+    'perchloroethylene': ['Tetrachloroethene (Tetrachlorethylene)'],
+    'dioxin': ['Total I-TEQ (Max)'],
+    'dioxins': ['Total I-TEQ (Max)'],
+}
+
+# Case-sensitive acronyms and chemical formulas, matched on the raw query text.
+FORMULAS = {
+    'F-': ['Fluoride'],
+    'Cl2': ['Chlorine (Free)'],
+    'NH2Cl': ['Monochloramine'],
+    'NO3': ['Nitrate (as N)'],
+    'NO3-': ['Nitrate (as N)'],
+    'NO2': ['Nitrite (as N)'],
+    'NO2-': ['Nitrite (as N)'],
+    'SO4': ['Sulphate'],
+    'CaCO3': ['Total Hardness (as CaCO3)'],
+    'Pb': ['Lead'],
+    'Hg': ['Mercury'],
+    'Cd': ['Cadmium'],
+    'Cu': ['Copper'],
+    'Fe': ['Iron'],
+    'Mn': ['Manganese'],
+    'Zn': ['Zinc'],
+    'Ni': ['Nickel'],
+    'CHCl3': ['Chloroform (CHC13)'],
+    'CHBr3': ['Bromoform (CHBr3)'],
+    'PFAS': ['Perfluorooctane Sulfonate (PFOS)', 'Perfluorooctanoic Acid (PFOA)'],
+    'pH': ['pH'],
+}
+
+# Parameter names that are also everyday English words or short acronyms.
+AMBIGUOUS_TERMS = {'lead', 'tin', 'iron', 'silver', 'colour', 'color', 'smell', 'hormone', 'hormones', 'ph', 'gh', 'tds',
+                   'thm', 'thms'}
+# Matched in any case by the automaton but only trusted in this exact spelling, through FORMULAS.
+CASE_SENSITIVE_TERMS = {'ph'}
+CONTEXT_AFTER = {'level', 'levels', 'content', 'concentration', 'concentrations', 'contamination', 'poisoning', 'pipe',
+                 'pipes', 'in', 'exposure', 'test', 'testing', 'limit', 'limits', 'mg', 'ug', 'ppb', 'ppm', 'of', 'reading',
+                 'readings', 'value', 'values'}
+CONTEXT_BEFORE = {'of', 'for', 'contains', 'containing', 'with', 'high', 'low', 'elevated', 'dissolved'}
+
+# Bracketed qualifiers that describe a measurement rather than naming the substance.
+_QUALIFIER_PATTERN = re.compile(r'^(as |total|free|cis|microscopy|fluoroprobe|fcm|elisa|max|somatic|male)', re.IGNORECASE)
+_ACRONYM_PATTERN = re.compile(r'^[A-Z0-9][A-Za-z0-9,\-\' ]{0,9}$')
+# Formulas of two or three letters ("Cu", "Ni", "DOC", "MX", "DEA") also occur in ordinary text.
+_SHORT_FORMULA_PATTERN = re.compile(r'^[A-Za-z]{2,3}$')
+_NEXT_WORD_PATTERN = re.compile(r'[^A-Za-z0-9]*([A-Za-z]+)')
+_PREVIOUS_WORD_PATTERN = re.compile(r'([A-Za-z]+)[^A-Za-z0-9]*$')
+# A single reading right after the term ("pH 8.5", "Pb: 0.02", "pH is 7"); runs of digits such as phone numbers do not count.
+_VALUE_AFTER_PATTERN = re.compile(r'\s*(?:(?:is|of|at|was|around|about)\s+|[:=]\s*)?\d{1,4}(?:\.\d+)?(?!\.?\d|\s*\d)')
+
+
+def normalise(text):
+    return ' '.join(re.sub(r'[^0-9a-z]+', ' ', text.lower()).split())
+
+
+class AhoCorasick:
+    # Multi-pattern automaton over characters; search() yields (end_index, pattern_id) for every occurrence.
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        self.lengths = []
+
+    def add(self, pattern):
+        state = 0
+        for char in pattern:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            state = next_state
+        pattern_id = len(self.lengths)
+        self.lengths.append(len(pattern))
+        self.output[state].append(pattern_id)
+        return pattern_id
+
+    def build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def search(self, text):
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for pattern_id in self.output[state]:
+                yield index, pattern_id
+
+
+class ParameterMatcher:
+    def __init__(self, parameter_list):
+        # Canonical names are returned exactly as they appear in the CSV (including stray whitespace) so that they can be
+        # used directly to filter the 'Parameter List' column.
+        self.canonical = {name.strip(): name for name in parameter_list}
+        self.automaton = AhoCorasick()
+        self.pattern_targets = []
+        self.pattern_terms = []
+        patterns = {}
+
+        def add_alias(alias, name):
+            key = normalise(alias)
+            if key and name in self.canonical:
+                targets = patterns.setdefault(key, [])
+                if name not in targets:
+                    targets.append(name)
+
+        formulas = {key: list(names) for key, names in FORMULAS.items()}
+        for raw_name in parameter_list:
+            name = raw_name.strip()
+            add_alias(name, name)
+            base = re.sub(r'\s*\([^)]*\)', '', name).strip()
+            # "Chlorine (Free)" -> "chlorine" is handled by SYNONYMS; only bracket-free bases of in-situ variants are skipped.
+            if base != name and not base.lower().endswith('in-situ'):
+                add_alias(base, name)
+            for bracketed in re.findall(r'\(([^)]*)\)', name):
+                bracketed = bracketed.strip()
+                if not bracketed or _QUALIFIER_PATTERN.match(bracketed):
+                    continue
+                if _ACRONYM_PATTERN.match(bracketed) and sum(c.isupper() for c in bracketed) >= 2:
+                    # Acronyms such as TDS, DOC or COD collide with ordinary words once lower-cased.
+                    formulas.setdefault(bracketed, [])
+                    if name not in formulas[bracketed]:
+                        formulas[bracketed].append(name)
+                else:
+                    add_alias(bracketed, name)
+        for alias, names in SYNONYMS.items():
+            for name in names:
+                add_alias(alias, name)
+
+        for key, names in patterns.items():
+            self.automaton.add(f' {key} ')
+            self.pattern_targets.append(names)
+            self.pattern_terms.append(key)
+        self.automaton.build()
+
+        formulas = {key: [n for n in names if n in self.canonical] for key, names in formulas.items()}
+        self.formula_targets = {key: names for key, names in formulas.items() if names}
+        alternation = '|'.join(re.escape(key) for key in sorted(self.formula_targets, key=len, reverse=True))
+        self.formula_regex = re.compile(rf'(?<![A-Za-z0-9])({alternation})(?![A-Za-z0-9])')
+
+    def _is_confident(self, term, tokens, start_token, end_token):
+        if term not in AMBIGUOUS_TERMS:
+            return True
+        if term in CASE_SENSITIVE_TERMS:
+            return False
+        after = tokens[end_token] if end_token < len(tokens) else None
+        before = tokens[start_token - 1] if start_token > 0 else None
+        return after in CONTEXT_AFTER or before in CONTEXT_BEFORE
+
+    def _formula_is_confident(self, text, match):
+        if not _SHORT_FORMULA_PATTERN.match(match.group(1)):
+            return True
+        if _VALUE_AFTER_PATTERN.match(text, match.end()):
+            return True
+        after = _NEXT_WORD_PATTERN.match(text, match.end())
+        before = _PREVIOUS_WORD_PATTERN.search(text, 0, match.start())
+        return ((after is not None and after.group(1).lower() in CONTEXT_AFTER)
+                or (before is not None and before.group(1).lower() in CONTEXT_BEFORE))
+
+    def _matches(self, text):
+        # (canonical names, confident) per term found in the text: words and phrases first, then acronyms and formulas
+        normalised = f' {normalise(text)} '
+        found = []
+        for end, pattern_id in self.automaton.search(normalised):
+            length = self.automaton.lengths[pattern_id]
+            # Spans exclude the padding spaces so that adjacent matches do not overlap.
+            found.append((end - length + 2, end, pattern_id))
+
+        # Keep the longest match where matches overlap, e.g. "total residual chlorine" over "chlorine".
+        found.sort(key=lambda m: (m[0], -(m[1] - m[0])))
+        kept = []
+        for start, end, pattern_id in found:
+            if kept and start < kept[-1][1]:
+                if end - start > kept[-1][1] - kept[-1][0]:
+                    kept[-1] = (start, end, pattern_id)
+                continue
+            kept.append((start, end, pattern_id))
+
+        tokens = normalised.split()
+        matches = []
+        for start, end, pattern_id in kept:
+            term = self.pattern_terms[pattern_id]
+            start_token = normalised[:start].count(' ') - 1
+            end_token = start_token + len(term.split())
+            names = [self.canonical[name] for name in self.pattern_targets[pattern_id]]
+            matches.append((names, self._is_confident(term, tokens, start_token, end_token)))
+
+        for match in self.formula_regex.finditer(text):
+            names = [self.canonical[name] for name in self.formula_targets[match.group(1)]]
+            matches.append((names, self._formula_is_confident(text, match)))
+        return matches
+
+    def match(self, text):
+        # Returns (confident, ambiguous): canonical parameter names in order of first appearance.
+        matches = self._matches(text)
+        confident = list(dict.fromkeys(name for names, is_confident in matches if is_confident for name in names))
+        ambiguous = [name for name in dict.fromkeys(name for names, is_confident in matches if not is_confident for name in names)
+                     if name not in confident]
+        return confident, ambiguous
+
+    def mentions(self, text):
+        # Every term found, confident or not, as the list of canonical names it stands for ("chlorine" -> two rows)
+        return [names for names, _ in self._matches(text)]
+
+    def identify(self, text):
+        # Confident matches only; an empty list means the caller should ask the LLM.
+        return self.match(text)[0]
@@ -10,109 +10,34 @@ logging.basicConfig(level=logging.INFO, filename="log.log", filemode = 'w')
 from helper_functions import llm
 from helper_functions.llm import get_completion_by_messages
 import os
-from langchain_openai import ChatOpenAI
-from langchain_openai import OpenAIEmbeddings
+from helper_functions.resource_registry import resources, get_embeddings_model
+from logics.water_quality_parameter_catalog import parameter_catalog
+from logics.email_archive_ingestion import open_email_vectordb, sync_email_vectordb
+from logics.water_quality_compliance import compliance_engine
 from langchain_community.vectorstores import Chroma
-from langchain_community.document_loaders import OutlookMessageLoader
-from langchain_community.vectorstores.utils import filter_complex_metadata
-from langchain_experimental.text_splitter import SemanticChunker
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from helper_functions.llm import count_tokens
-from langchain.chains import RetrievalQA
-from langchain.prompts import PromptTemplate
-import chromadb
+from logics.water_quality_substantiation import (reference_index_version, reference_vectordb, substantiate_water_quality_parameter,
+                                                 substantiation_model)
+from functools import partial
 
 # Import the data file in csv format
-import pandas as pd
 import json
-# Convert .csv table into pandas Dataframe
-water_quality_df = pd.read_csv('data/utf8_Consolidated WQ Parameters.csv')
-parameter_list = water_quality_df['Parameter List'].tolist()
+# Shared catalog of the .csv table, loaded once per process
+parameter_list = parameter_catalog.parameter_list
+# Identifies parameters named in a query without an LLM call
+parameter_matcher = parameter_catalog.matcher
 
 # Supporting functions
 # Creation of vectordb for email responses
 def create_email_vectordb(embeddings_model,vectordb_name):
-    vectorstore_path = "data/vectordb_" + vectordb_name
-    # Use .listdir() method to list all the files and directories of a specified location
-    # Define directory for emails
-    directory = os.listdir('data/Queries Received and Email Responses')
-    # Empty list which will be used to append new values
-    list_of_emails = []
-
-    for filename in directory:
-        filename = "data" + '/' + 'Queries Received and Email Responses' + '/' + filename
-        loader = OutlookMessageLoader(filename)
-        text_from_file = loader.load()
-        # append the text from the single file to the existing list
-        list_of_emails.append(text_from_file[0])
-        # print(f"Successfully read from {filename}")
-    # Create the text splitter
-    text_splitter = SemanticChunker(embeddings_model)
-    # Split the documents into smaller chunks
-    splitted_documents = text_splitter.split_documents(list_of_emails)
-    # Create Vector Database
-    vectordb = Chroma.from_documents(
-        filter_complex_metadata(splitted_documents),
-        embedding=embeddings_model, 
-        collection_name= vectordb_name, 
-        persist_directory= vectorstore_path # define location directory to save the vectordb
-    )
+    # Builds the collection through the incremental sync, which also writes the ingestion manifest used by later syncs
+    vectordb = open_email_vectordb(embeddings_model, vectordb_name)
+    sync_email_vectordb(vectordb, embeddings_model, vectordb_name)
     return vectordb # return vectordb to be used
 
-def create_wq_reference_vectordb(embeddings_model):
-    # Load in documents 
-    loader_eph = PyPDFLoader('data\code-of-practice-on-drinking-water-sampling-and-safety-plans-sfa-apr-2019.pdf')
-    doc_eph = loader_eph.load()
-    loader_who = PyPDFLoader('data\WHO GDWQ 4th ed 1st 2nd addenda 2022-eng.pdf')
-    doc_who = loader_who.load()
-    loader_sfa = PyPDFLoader('data\Environmental Public Health (Water suitable for drinking)(No. 2) Regulations SFA Apr 2019.pdf')
-    doc_sfa = loader_sfa.load()
- 
-    # Creating character splitter for document splitting and chunking
-    splitter1 = RecursiveCharacterTextSplitter(
-        separators=["\n\n", "\n", " ", ""],
-        chunk_size=500,
-        chunk_overlap=50,
-        length_function=count_tokens
-    )
-
-    split_eph = splitter1.split_documents(doc_eph)
-    split_who = splitter1.split_documents(doc_who)
-    split_sfa = splitter1.split_documents(doc_sfa)
-    split_doc_merge = split_eph + split_who + split_sfa
-
-    # Creating basic vector database
-    vectordb = Chroma.from_documents(
-        collection_name="wq_reference",
-        documents=split_doc_merge,
-        embedding=embeddings_model,
-        persist_directory="data/vectordb_wq_reference",  # Where to save data locally, remove if not neccesary
-    )
-
-    # # Alternate Code
-
-    # doc_load = doc_eph + doc_who + doc_sfa
-    # all_chunks = []
-    # for doc in doc_load:
-    #     chunks = splitter1.split_text(doc.page_content)
-    #     for chunk in chunks:
-    #         chunked_doc = {"text": chunk,"metadata":doc.metadata}
-    #         all_chunks.append(chunked_doc)
-
-    # vectordb = Chroma.from_texts(
-    #     texts=[doc["text"] for doc in all_chunks],
-    #     embedding=embeddings_model,
-    #     metadatas=[doc["metadata"] for doc in all_chunks],
-    #     collection_name="wq_reference",
-    #     persist_directory="data/vectordb_wq_reference"
-    # )
-    return vectordb
-
 # Checking for presence of vectordb, spun off as a separate function as it is used on Step 3 and 4.
-def vectordb_acquire(vectordb_name: str):
+def _load_vectordb(vectordb_name: str):
     # Create embeddings model
-    embeddings_model = OpenAIEmbeddings(model = 'text-embedding-3-small',show_progress_bar=True)
+    embeddings_model = get_embeddings_model('text-embedding-3-small')
     vectorstore_path = "data\\vectordb_" + vectordb_name
     # Create code to differentiate between the two vectordbs (vectordb_email_semantic and vectordb_reference) in this workflow
     match vectordb_name.lower():
@@ -139,31 +64,26 @@ def vectordb_acquire(vectordb_name: str):
 
             return vectordb # return vectordb to be used
         
-        case "vectordb_wq_reference":
-        # check for the presence of vectordb_wq_reference
-            if os.path.exists('data\\vectordb_wq_reference'):
-                # If directory exists, load using Chroma.
-                print('VectorDB found, now loading existing vector database...')
-                # Obtain current script's directory
-                current_dir = os.path.dirname(os.path.abspath(__file__))
-                # Go up one level to main directory
-                root_dir = os.path.dirname(current_dir)
-                # construct path to the vectordb folder
-                persist_directory = os.path.join(root_dir,'data\\vectordb_wq_reference')
-                vectordb = Chroma(
-                    persist_directory=persist_directory,
-                    collection_name='wq_reference',
-                    embedding_function=embeddings_model
-                )
-                print('wq_reference vectordb loaded successfully!')
-            else:
-                print('wq_reference vector database directory not found, proceeding to create vector database.')
-                vectordb = create_wq_reference_vectordb(embeddings_model)
-                
-            return vectordb # return vectordb to be used
-        
+# Loaded (or created) once per process and shared by all sessions, instead of opening the Chroma collection on every call
+def vectordb_acquire(vectordb_name: str):
+    if vectordb_name == "vectordb_wq_reference":
+        return reference_vectordb()
+    return resources.get(('vectordb', vectordb_name), partial(_load_vectordb, vectordb_name))
+
+# Opens both vectordbs and creates the step 3 chat model ahead of the first query
+def warm_up_wq_resources():
+    vectordb_acquire('email_semantic_98')
+    vectordb_acquire("vectordb_wq_reference")
+    substantiation_model()
+    reference_index_version()
+
 # 1. identify_water_quality parameter (keep)
 def identify_water_quality_parameter(user_message):
+    # Local lookup first; the LLM is only asked when no parameter is confidently named in the query
+    local_matches = parameter_matcher.identify(user_message)
+    if local_matches:
+        return local_matches
+
     delimiter = "####"
 
     system_message = f"""
@@ -183,53 +103,18 @@ def identify_water_quality_parameter(user_message):
         {'role':'user',
          'content': f"{delimiter}{user_message}{delimiter}"},
     ]
-    output_step_1 = get_completion_by_messages(messages)
+    output_step_1 = get_completion_by_messages(messages, call_site='identify_water_quality_parameter')
     output_step_1 = eval(output_step_1)
     return output_step_1 
 
 # 2. match with PUB water quality standards and regulatory guidelines (keep)
 def get_water_quality_guidelines(list_of_water_quality_parameters: list):
-    wq_parameter_guidelines = water_quality_df[water_quality_df['Parameter List'].isin(list_of_water_quality_parameters)]
-    wq_parameter_guidelines = wq_parameter_guidelines.to_markdown()
+    # Rows are pre-rendered in the shared catalog; assembling the table is a lookup and a string join
+    wq_parameter_guidelines = parameter_catalog.to_markdown(list_of_water_quality_parameters)
     return wq_parameter_guidelines
 
 #3. Extract further information with reference from WHO, SFA and EPH reference material based in parameters from previous step
-def substantiate_water_quality_parameter(wq_parameters): # consider using the parameters or user input.
-    # Check for presence of vectordb
-    vectordb = vectordb_acquire("vectordb_wq_reference")
-    # llm to be used in RAG pipeplines in this notebook
-    llm = ChatOpenAI(model='gpt-4o-mini', temperature=0, seed=42)
-    template = """You are an AI tasked with finding relevant reference materials related to water quality parameters mentioned in the question. 
-    Use the provided context to formulate a concise answer. If you don't know the answer, say, "I don't know"—don't guess. 
-    Answer in 5 sentences or fewer, and cite specific sections or references where possible.
-
-    Context: {context}
-
-    Question: {question}
-
-    Your Answer: 
-    """
-    QA_CHAIN_PROMPT = PromptTemplate.from_template(template)
-    print('QA_chain prompt formed')
-    
-    # Debugging: Check if retrieval returns results
-    retrieved_docs = vectordb.as_retriever(k=10).get_relevant_documents(f'Obtain guideline values for {wq_parameters}')
-    if not retrieved_docs:
-        return "No relevant reference materials found for the given parameters."
-
-    # Run the RetrievalQA chain
-    try:
-        qa_chain = RetrievalQA.from_chain_type(
-            llm=llm,
-            retriever=vectordb.as_retriever(k=10),
-            return_source_documents=False,  # Set to True for debugging if needed
-            chain_type_kwargs={"prompt": QA_CHAIN_PROMPT}
-        )
-        answer = qa_chain.invoke(f'Obtain the guideline values and relevant information for the parameters listed in {wq_parameters}')
-    except Exception as e:
-        return f"Error during QA chain execution: {str(e)}"
-    
-    return answer
+# Shared with the async handler and the precompute job (logics/water_quality_substantiation.py)
 
 #4. Get relevant email records
 def get_email_records(user_message,vectordb_name):
@@ -239,9 +124,20 @@ def get_email_records(user_message,vectordb_name):
     output_step_4 = vectordb.similarity_search_with_relevance_scores(user_message, k=4)
     return output_step_4
 
+def _measurement_section(compliance_facts):
+    # Verdicts computed by logics/water_quality_compliance.py, stated to the LLM as facts rather than left for it to work out
+    if not compliance_facts:
+        return ''
+    return f"""
+    ### Customer Readings (verified)
+    The customer's own readings were already checked against the limits. Treat these verdicts as facts and do not recalculate them:
+    {compliance_facts}
+    """
+
 # 5. generate_response_based_on_water_quality_standards
-def generate_response_based_on_water_quality_standards(user_message, water_quality_parameters, wq_parameters_reference, email_archives):
+def generate_response_based_on_water_quality_standards(user_message, water_quality_parameters, wq_parameters_reference, email_archives, compliance_facts=''):
     delimiter = "####"
+    measurement_section = _measurement_section(compliance_facts)
 
     # ORIGINAL PROMPT
     # system_message = f"""
@@ -290,7 +186,7 @@ def generate_response_based_on_water_quality_standards(user_message, water_quali
     - PUB Drinking Water Standard Range (3rd column)  
     - Use WHO Guidelines and EPH Regulations to substantiate the response for each parameter.
     - Conclude whether the water meets safety guidelines for drinking based on the data.
-    
+    {measurement_section}
     ### Step 3: Draft a Customer-Focused Email  
     Write a draft email response using information from {email_archives}.  
     - The tone should be friendly, professional, and reassuring.  
@@ -316,7 +212,7 @@ def generate_response_based_on_water_quality_standards(user_message, water_quali
          'content': f"{delimiter}{user_message}{delimiter}"},
     ]
 
-    response_to_customer = get_completion_by_messages(messages)
+    response_to_customer = get_completion_by_messages(messages, call_site='generate_response_based_on_water_quality_standards')
     # response_to_customer = response_to_customer.split(delimiter)[-1]
     return response_to_customer
 
@@ -329,15 +225,17 @@ def process_user_message_wq(user_input):
 
     # Process 2: Match with PUB water quality standards and regulatory guidelines
     process_step_2 = get_water_quality_guidelines(process_step_1)
+    # Readings quoted in the query are checked locally against the catalog limits
+    compliance_facts = compliance_engine.compliance_facts(user_input, process_step_1)
 
     # Process 3: Match with PUB water quality standards and regulatory guidelines
-    process_step_3 = substantiate_water_quality_parameter(process_step_1)
+    process_step_3 = substantiate_water_quality_parameter(process_step_1, user_input)
     print('qa_chain invoked successfully initiaized')
 
     # Process 4: Match with PUB water quality standards and regulatory guidelines
     process_step_4 = get_email_records(user_input,'email_semantic_98') 
 
     # Process 5: Generate Response based on Course Details
-    reply = generate_response_based_on_water_quality_standards(user_input,process_step_2,process_step_3,process_step_4)
+    reply = generate_response_based_on_water_quality_standards(user_input,process_step_2,process_step_3,process_step_4,compliance_facts)
 
     return reply
@@ -10,112 +10,42 @@ logging.basicConfig(level=logging.INFO, filename="log.log", filemode = 'w')
 from helper_functions import llm
 from helper_functions.llm import get_completion_by_messages
 import os
-from langchain_openai import ChatOpenAI
-from langchain_openai import OpenAIEmbeddings
+from helper_functions.resource_registry import resources, get_embeddings_model
+from logics.water_quality_parameter_catalog import parameter_catalog
+from logics.email_archive_ingestion import open_email_vectordb, sync_email_vectordb
+from logics.water_quality_compliance import compliance_engine
 from langchain_community.vectorstores import Chroma
-from langchain_community.document_loaders import OutlookMessageLoader
-from langchain_community.vectorstores.utils import filter_complex_metadata
-from langchain_experimental.text_splitter import SemanticChunker
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from helper_functions.llm import count_tokens
-from langchain.chains import RetrievalQA
-from langchain.prompts import PromptTemplate
-import chromadb
+from concurrent.futures import ThreadPoolExecutor
+from helper_functions.retrieval_planner import plan_retrieval_async
+from logics.water_quality_substantiation import (NO_REFERENCES_ANSWER, SUBSTANTIATION_MAX_WORKERS,
+                                                 SUBSTANTIATION_PROMPT_VERSION, SUBSTANTIATION_TOP_K, merge_substantiations,
+                                                 reference_index_version, reference_vectordb, split_by_source,
+                                                 substantiation_cache, substantiation_model, substantiation_prompt,
+                                                 substantiation_question, unique_parameters)
+from helper_functions.query_context import QueryContext, embedding_model, search_with_relevance_scores
 
 import asyncio
 from functools import partial
 
 # Import the data file in csv format
-import pandas as pd
 import json
-# Convert .csv table into pandas Dataframe
-water_quality_df = pd.read_csv('data/utf8_Consolidated WQ Parameters.csv')
-parameter_list = water_quality_df['Parameter List'].tolist()
+# Shared catalog of the .csv table, loaded once per process
+parameter_list = parameter_catalog.parameter_list
+# Identifies parameters named in a query without an LLM call
+parameter_matcher = parameter_catalog.matcher
 
 # Supporting functions
 # Creation of vectordb for email responses
 def create_email_vectordb(embeddings_model,vectordb_name):
-    vectorstore_path = "data/vectordb_" + vectordb_name
-    # Use .listdir() method to list all the files and directories of a specified location
-    # Define directory for emails
-    directory = os.listdir('data/Queries Received and Email Responses')
-    # Empty list which will be used to append new values
-    list_of_emails = []
-
-    for filename in directory:
-        filename = "data" + '/' + 'Queries Received and Email Responses' + '/' + filename
-        loader = OutlookMessageLoader(filename)
-        text_from_file = loader.load()
-        # append the text from the single file to the existing list
-        list_of_emails.append(text_from_file[0])
-        # print(f"Successfully read from {filename}")
-    # Create the text splitter
-    text_splitter = SemanticChunker(embeddings_model)
-    # Split the documents into smaller chunks
-    splitted_documents = text_splitter.split_documents(list_of_emails)
-    # Create Vector Database
-    vectordb = Chroma.from_documents(
-        filter_complex_metadata(splitted_documents),
-        embedding=embeddings_model, 
-        collection_name= vectordb_name, 
-        persist_directory= vectorstore_path # define location directory to save the vectordb
-    )
+    # Builds the collection through the incremental sync, which also writes the ingestion manifest used by later syncs
+    vectordb = open_email_vectordb(embeddings_model, vectordb_name)
+    sync_email_vectordb(vectordb, embeddings_model, vectordb_name)
     return vectordb # return vectordb to be used
 
-def create_wq_reference_vectordb(embeddings_model):
-    # Load in documents 
-    loader_eph = PyPDFLoader('data\code-of-practice-on-drinking-water-sampling-and-safety-plans-sfa-apr-2019.pdf')
-    doc_eph = loader_eph.load()
-    loader_who = PyPDFLoader('data\WHO GDWQ 4th ed 1st 2nd addenda 2022-eng.pdf')
-    doc_who = loader_who.load()
-    loader_sfa = PyPDFLoader('data\Environmental Public Health (Water suitable for drinking)(No. 2) Regulations SFA Apr 2019.pdf')
-    doc_sfa = loader_sfa.load()
- 
-    # Creating character splitter for document splitting and chunking
-    splitter1 = RecursiveCharacterTextSplitter(
-        separators=["\n\n", "\n", " ", ""],
-        chunk_size=500,
-        chunk_overlap=50,
-        length_function=count_tokens
-    )
-
-    split_eph = splitter1.split_documents(doc_eph)
-    split_who = splitter1.split_documents(doc_who)
-    split_sfa = splitter1.split_documents(doc_sfa)
-    split_doc_merge = split_eph + split_who + split_sfa
-
-    # Creating basic vector database
-    vectordb = Chroma.from_documents(
-        collection_name="wq_reference",
-        documents=split_doc_merge,
-        embedding=embeddings_model,
-        persist_directory="data/vectordb_wq_reference",  # Where to save data locally, remove if not neccesary
-    )
-
-    # # Alternate Code
-
-    # doc_load = doc_eph + doc_who + doc_sfa
-    # all_chunks = []
-    # for doc in doc_load:
-    #     chunks = splitter1.split_text(doc.page_content)
-    #     for chunk in chunks:
-    #         chunked_doc = {"text": chunk,"metadata":doc.metadata}
-    #         all_chunks.append(chunked_doc)
-
-    # vectordb = Chroma.from_texts(
-    #     texts=[doc["text"] for doc in all_chunks],
-    #     embedding=embeddings_model,
-    #     metadatas=[doc["metadata"] for doc in all_chunks],
-    #     collection_name="wq_reference",
-    #     persist_directory="data/vectordb_wq_reference"
-    # )
-    return vectordb
-
 # Checking for presence of vectordb, spun off as a separate function as it is used on Step 3 and 4.
-def vectordb_acquire(vectordb_name: str):
+def _load_vectordb(vectordb_name: str):
     # Create embeddings model
-    embeddings_model = OpenAIEmbeddings(model = 'text-embedding-3-small',show_progress_bar=True)
+    embeddings_model = get_embeddings_model('text-embedding-3-small')
     vectorstore_path = "data/vectordb_" + vectordb_name
     # Create code to differentiate between the two vectordbs (vectordb_email_semantic and vectordb_reference) in this workflow
     match vectordb_name.lower():
@@ -142,31 +72,40 @@ def vectordb_acquire(vectordb_name: str):
 
             return vectordb # return vectordb to be used
         
-        case "vectordb_wq_reference":
-        # check for the presence of vectordb_wq_reference
-            if os.path.exists('data/vectordb_wq_reference'):
-                # If directory exists, load using Chroma.
-                print('VectorDB found, now loading existing vector database...')
-                # Obtain current script's directory
-                current_dir = os.path.dirname(os.path.abspath(__file__))
-                # Go up one level to main directory
-                root_dir = os.path.dirname(current_dir)
-                # construct path to the vectordb folder
-                persist_directory = os.path.join(root_dir,'data/vectordb_wq_reference')
-                vectordb = Chroma(
-                    persist_directory=persist_directory,
-                    collection_name='wq_reference',
-                    embedding_function=embeddings_model
-                )
-                print(f'{vectordb_name} vectordb loaded successfully!')
-            else:
-                print(f'{vectordb_name} vector database directory not found, proceeding to create vector database.')
-                vectordb = create_wq_reference_vectordb(embeddings_model)
-                
-            return vectordb # return vectordb to be used
-        
+# Loaded (or created) once per process and shared by all sessions, instead of opening the Chroma collection on every call
+def vectordb_acquire(vectordb_name: str):
+    if vectordb_name == "vectordb_wq_reference":
+        return reference_vectordb()
+    return resources.get(('vectordb', vectordb_name), partial(_load_vectordb, vectordb_name))
+
+# Opens both vectordbs and creates the step 3 chat model ahead of the first query
+def warm_up_wq_resources():
+    vectordb_acquire('email_semantic_98')
+    vectordb_acquire("vectordb_wq_reference")
+    substantiation_model()
+    reference_index_version()
+
 # 1. identify_water_quality parameter (keep)
 def identify_water_quality_parameter(user_message):
+    # Local lookup first; the LLM is only asked when no parameter is confidently named in the query
+    local_matches = parameter_matcher.identify(user_message)
+    if local_matches:
+        return local_matches
+
+    output_step_1 = get_completion_by_messages(_identification_messages(user_message), call_site='identify_water_quality_parameter')
+    output_step_1 = eval(output_step_1)
+    return output_step_1 
+
+async def identify_water_quality_parameter_async(user_message):
+    local_matches = parameter_matcher.identify(user_message)
+    if local_matches:
+        return local_matches
+
+    output_step_1 = await llm.get_completion_by_messages_async(_identification_messages(user_message), call_site='identify_water_quality_parameter')
+    output_step_1 = eval(output_step_1)
+    return output_step_1 
+
+def _identification_messages(user_message):
     delimiter = "####"
 
     system_message = f"""
@@ -186,65 +125,106 @@ def identify_water_quality_parameter(user_message):
         {'role':'user',
          'content': f"{delimiter}{user_message}{delimiter}"},
     ]
-    output_step_1 = get_completion_by_messages(messages)
-    output_step_1 = eval(output_step_1)
-    return output_step_1 
+    return messages
 
 # 2. match with PUB water quality standards and regulatory guidelines (keep)
 def get_water_quality_guidelines(list_of_water_quality_parameters: list):
-    wq_parameter_guidelines = water_quality_df[water_quality_df['Parameter List'].isin(list_of_water_quality_parameters)]
-    wq_parameter_guidelines = wq_parameter_guidelines.to_markdown()
+    # Rows are pre-rendered in the shared catalog; assembling the table is a lookup and a string join
+    wq_parameter_guidelines = parameter_catalog.to_markdown(list_of_water_quality_parameters)
     return wq_parameter_guidelines
 
 #3. Extract further information with reference from WHO, SFA and EPH reference material based in parameters from previous step
-def substantiate_water_quality_parameter(wq_parameters): # consider using the parameters or user input.
-    # Check for presence of vectordb
-    vectordb = vectordb_acquire("vectordb_wq_reference")
-    # llm to be used in RAG pipeplines in this notebook
-    llm = ChatOpenAI(model='gpt-4o-mini', temperature=0, seed=42)
-    template = """You are an AI tasked with finding relevant reference materials related to water quality parameters mentioned in the question. 
-    Use the provided context to formulate a concise answer. If you don't know the answer, say, "I don't know"—don't guess. 
-    Answer in 5 sentences or fewer, and cite specific sections or references where possible.
-
-    Context: {context}
+# The prompt, answer cache and catalog/RAG split are shared with the sync handler (logics/water_quality_substantiation.py)
 
-    Question: {question}
+# Bounded executors for the blocking parts of the async pipeline, kept apart from the event loop's default pool
+vector_executor = ThreadPoolExecutor(max_workers=int(os.getenv('WQ_VECTOR_WORKERS', 4)), thread_name_prefix='wq-vector')
+cache_executor = ThreadPoolExecutor(max_workers=int(os.getenv('WQ_CACHE_WORKERS', 2)), thread_name_prefix='wq-cache')
 
-    Your Answer: 
-    """
-    QA_CHAIN_PROMPT = PromptTemplate.from_template(template)
-    print('QA_chain prompt formed')
-    
-    # Debugging: Check if retrieval returns results
-    retrieved_docs = vectordb.as_retriever(k=10).get_relevant_documents(f'Obtain guideline values for {wq_parameters}')
-    if not retrieved_docs:
-        return "No relevant reference materials found for the given parameters."
+async def _substantiate_parameter_async(parameter, documents, semaphore):
+    if not documents:
+        return NO_REFERENCES_ANSWER, True
 
-    # Run the RetrievalQA chain
     try:
-        qa_chain = RetrievalQA.from_chain_type(
-            llm=llm,
-            retriever=vectordb.as_retriever(k=10),
-            return_source_documents=False,  # Set to True for debugging if needed
-            chain_type_kwargs={"prompt": QA_CHAIN_PROMPT}
-        )
-        answer = qa_chain.invoke(f'Obtain the guideline values and relevant information for the parameters listed in {wq_parameters}')
+        async with semaphore:
+            answer = await substantiation_model().ainvoke(substantiation_prompt(parameter, documents))
     except Exception as e:
-        return f"Error during QA chain execution: {str(e)}"
-    
-    return answer
+        return f"Error during QA chain execution: {str(e)}", False
+
+    return answer.content, True
+
+async def _substantiate_many_async(parameters):
+    # Same flow as the sync _substantiate_many: SQLite and Chroma calls go to the dedicated executors, LLM calls are awaited.
+    loop = asyncio.get_running_loop()
+    index_version = await loop.run_in_executor(vector_executor, reference_index_version)
+    answers = await loop.run_in_executor(
+        cache_executor, substantiation_cache.get_many, parameters, index_version, SUBSTANTIATION_PROMPT_VERSION)
+    missing = [parameter for parameter in parameters if parameter not in answers]
+    if missing:
+        vectordb = await loop.run_in_executor(vector_executor, reference_vectordb)
+        plan = await plan_retrieval_async(vectordb, [substantiation_question(parameter) for parameter in missing],
+                                          k=SUBSTANTIATION_TOP_K, call_site='substantiate_water_quality_parameter',
+                                          executor=vector_executor)
+        semaphore = asyncio.Semaphore(SUBSTANTIATION_MAX_WORKERS)
+        results = await asyncio.gather(*(
+            _substantiate_parameter_async(parameter, plan.documents_for(position), semaphore)
+            for position, parameter in enumerate(missing)
+        ))
+        for parameter, (answer, cacheable) in zip(missing, results):
+            answers[parameter] = answer
+            if cacheable:
+                await loop.run_in_executor(
+                    cache_executor, substantiation_cache.put, parameter, index_version, SUBSTANTIATION_PROMPT_VERSION, answer)
+    return answers
+
+async def substantiate_water_quality_parameter_async(wq_parameters, user_message=None):
+    parameters = unique_parameters(wq_parameters)
+    if not parameters:
+        return NO_REFERENCES_ANSWER
+    from_catalog, rag_parameters = split_by_source(parameters, user_message)
+    from_references = await _substantiate_many_async(rag_parameters) if rag_parameters else {}
+    return merge_substantiations(parameters, from_catalog, from_references)
 
 #4. Get relevant email records
-def get_email_records(user_message,vectordb_name):
+def get_email_records(user_message,vectordb_name,query_context=None):
     # Check for presence of vectordb
     vectordb = vectordb_acquire(vectordb_name)
 
-    output_step_4 = vectordb.similarity_search_with_relevance_scores(user_message, k=4)
+    # The query embedding is shared with the other searches of the same request
+    query_context = query_context or QueryContext(user_message)
+    output_step_4 = search_with_relevance_scores(vectordb, query_context.embedding(embedding_model(vectordb)), k=4)
     return output_step_4
 
+async def get_email_records_async(user_message, vectordb_name, query_context=None):
+    loop = asyncio.get_running_loop()
+    vectordb = await loop.run_in_executor(vector_executor, vectordb_acquire, vectordb_name)
+    query_context = query_context or QueryContext(user_message)
+    query_embedding = await query_context.aembedding(embedding_model(vectordb))
+    return await loop.run_in_executor(vector_executor, search_with_relevance_scores, vectordb, query_embedding, 4)
+
+def _measurement_section(compliance_facts):
+    # Verdicts computed by logics/water_quality_compliance.py, stated to the LLM as facts rather than left for it to work out
+    if not compliance_facts:
+        return ''
+    return f"""
+    ### Customer Readings (verified)
+    The customer's own readings were already checked against the limits. Treat these verdicts as facts and do not recalculate them:
+    {compliance_facts}
+    """
+
 # 5. generate_response_based_on_water_quality_standards
-def generate_response_based_on_water_quality_standards(user_message, water_quality_parameters, wq_parameters_reference, email_archives):
+def generate_response_based_on_water_quality_standards(user_message, water_quality_parameters, wq_parameters_reference, email_archives, compliance_facts=''):
+    messages = _wq_response_messages(user_message, water_quality_parameters, wq_parameters_reference, email_archives, compliance_facts)
+    response_to_customer = get_completion_by_messages(messages, call_site='generate_response_based_on_water_quality_standards')
+    # response_to_customer = response_to_customer.split(delimiter)[-1]
+    return response_to_customer
+
+async def generate_response_based_on_water_quality_standards_async(user_message, water_quality_parameters, wq_parameters_reference, email_archives, compliance_facts=''):
+    messages = _wq_response_messages(user_message, water_quality_parameters, wq_parameters_reference, email_archives, compliance_facts)
+    return await llm.get_completion_by_messages_async(messages, call_site='generate_response_based_on_water_quality_standards')
+
+def _wq_response_messages(user_message, water_quality_parameters, wq_parameters_reference, email_archives, compliance_facts=''):
     delimiter = "####"
+    measurement_section = _measurement_section(compliance_facts)
 
     # ORIGINAL PROMPT
     # system_message = f"""
@@ -293,7 +273,7 @@ def generate_response_based_on_water_quality_standards(user_message, water_quali
     - PUB Drinking Water Standard Range (3rd column)  
     - Use WHO Guidelines and EPH Regulations to substantiate the response for each parameter.
     - Conclude whether the water meets safety guidelines for drinking based on the data.
-    
+    {measurement_section}
     ### Step 3: Draft a Customer-Focused Email  
     Write a draft email response using information from {email_archives}.  
     - The tone should be friendly, professional, and reassuring.  
@@ -318,38 +298,35 @@ def generate_response_based_on_water_quality_standards(user_message, water_quali
         {'role':'user',
          'content': f"{delimiter}{user_message}{delimiter}"},
     ]
-
-    response_to_customer = get_completion_by_messages(messages)
-    # response_to_customer = response_to_customer.split(delimiter)[-1]
-    return response_to_customer
+    return messages
 
 # response = generate_response_based_on_water_quality_standards(user_input,result_step_2,result_step_3,result_step_4)
 # print(response)
 
-async def process_user_message_wq(user_input):
-
-    # Process 1: identify_water_quality parameter
-    process_step_1 = identify_water_quality_parameter(user_input)
-
-    # Setup vectordbs before entering async portions
+async def process_user_message_wq(user_input, query_context=None):
+    # Step 4 only needs the query, so it starts together with step 1. Step 2 is a catalog lookup and step 3 starts as
+    # soon as step 1 returns, concurrently with whatever is left of step 4. End-to-end latency follows the critical path
+    # (step 1 -> step 3 -> step 5) rather than the sum of the stages.
     email_vectordb = 'email_semantic_98'
-    vectordb_acquire('email_semantic_98')
-    vectordb_acquire("vectordb_wq_reference")
-
-    # Create tasks for processes 2, 3, and 4
-    loop = asyncio.get_event_loop()
-    tasks = [
-        loop.run_in_executor(None, partial(get_water_quality_guidelines, process_step_1)),
-        loop.run_in_executor(None, partial(substantiate_water_quality_parameter, process_step_1)),
-        loop.run_in_executor(None, partial(get_email_records, user_input, email_vectordb))
-    ]
-    # Wait for all tasks to complete
-
-    process_step_2, process_step_3, process_step_4 = await asyncio.gather(*tasks)
+    email_records = asyncio.ensure_future(get_email_records_async(user_input, email_vectordb, query_context))
+    try:
+        # Process 1: identify_water_quality parameter
+        process_step_1 = await identify_water_quality_parameter_async(user_input)
+
+        # Processes 2, 3 and 4; readings quoted in the query are checked locally against the catalog limits
+        process_step_2 = get_water_quality_guidelines(process_step_1)
+        compliance_facts = compliance_engine.compliance_facts(user_input, process_step_1)
+        process_step_3, process_step_4 = await asyncio.gather(
+            substantiate_water_quality_parameter_async(process_step_1, user_input),
+            email_records,
+        )
+    except BaseException:
+        email_records.cancel()
+        raise
     print('All async processes completed successfully')
 
     # Process 5: Generate Response based on Course Details
-    reply = generate_response_based_on_water_quality_standards(user_input, process_step_2, process_step_3, process_step_4)
+    reply = await generate_response_based_on_water_quality_standards_async(user_input, process_step_2, process_step_3, process_step_4, compliance_facts)
 
     return reply
 # To use this function, you'll need to run it in an async context:
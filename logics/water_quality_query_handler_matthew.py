@@ -10,24 +10,23 @@ logging.basicConfig(level=logging.INFO, filename="log.log", filemode = 'w')
 from helper_functions import llm
 from helper_functions.llm import get_completion_by_messages
 import os
-from langchain_openai import ChatOpenAI
-from langchain_openai import OpenAIEmbeddings
+from helper_functions.langchain_models import get_chat_model
+from helper_functions.resource_registry import resources, get_embeddings_model
+from logics.water_quality_parameter_catalog import parameter_catalog
+from logics.email_archive_ingestion import open_email_vectordb, sync_email_vectordb
 from langchain_community.vectorstores import Chroma
-from langchain_community.document_loaders import OutlookMessageLoader
-from langchain_community.vectorstores.utils import filter_complex_metadata
-from langchain_experimental.text_splitter import SemanticChunker
 from langchain.chains import RetrievalQA, create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain_core.prompts import ChatPromptTemplate
 from langchain.chains.combine_documents import create_stuff_documents_chain
-import chromadb
+from functools import partial
 
 # Import the data file in csv format
-import pandas as pd
 import json
-# Convert .csv table into pandas Dataframe
-water_quality_df = pd.read_csv('data/utf8_Consolidated WQ Parameters.csv')
-parameter_list = water_quality_df['Parameter List'].tolist()
+# Shared catalog of the .csv table, loaded once per process
+parameter_list = parameter_catalog.parameter_list
+# Identifies parameters named in a query without an LLM call
+parameter_matcher = parameter_catalog.matcher
 
 # Supporting functions
 def format_docs(docs):
@@ -35,38 +34,16 @@ def format_docs(docs):
 
 # Creation of vectordb
 def create_email_vectordb(embeddings_model,vectordb_name):
-    vectorstore_path = "data/vectordb_" + vectordb_name
-    # Use .listdir() method to list all the files and directories of a specified location
-    # Define directory for emails
-    directory = os.listdir('data/Queries Received and Email Responses')
-    # Empty list which will be used to append new values
-    list_of_emails = []
-
-    for filename in directory:
-        filename = "data" + '/' + 'Queries Received and Email Responses' + '/' + filename
-        loader = OutlookMessageLoader(filename)
-        text_from_file = loader.load()
-        # append the text from the single file to the existing list
-        list_of_emails.append(text_from_file[0])
-        # print(f"Successfully read from {filename}")
-# Create the text splitter
-    text_splitter = SemanticChunker(embeddings_model)
-# Split the documents into smaller chunks
-    splitted_documents = text_splitter.split_documents(list_of_emails)
-# Create Vector Database
-    vectordb = Chroma.from_documents(
-        filter_complex_metadata(splitted_documents),
-        embedding=embeddings_model, 
-        collection_name= vectordb_name, 
-        persist_directory= vectorstore_path # define location directory to save the vectordb
-    ) 
+    # Builds the collection through the incremental sync, which also writes the ingestion manifest used by later syncs
+    vectordb = open_email_vectordb(embeddings_model, vectordb_name)
+    sync_email_vectordb(vectordb, embeddings_model, vectordb_name)
     return vectordb # return vectordb to be used
 
 # Checking for presence of vectordb, spun off as a separate function as it is used on Step 3 and 4.
-def vectordb_acquire(vectorstore_name):
+def _load_vectordb(vectorstore_name):
 
     # Create embeddings model
-    embeddings_model = OpenAIEmbeddings(model = 'text-embedding-3-small',show_progress_bar=True)
+    embeddings_model = get_embeddings_model('text-embedding-3-small')
     # check for presence of email_semantic vectordb
     vectorstore_path = "data\\vectordb_" + vectorstore_name
     if os.path.exists(vectorstore_path):
@@ -90,9 +67,18 @@ def vectordb_acquire(vectorstore_name):
 
     return vectordb
 
+# Loaded (or created) once per process and shared by all sessions, instead of opening the Chroma collection on every call
+def vectordb_acquire(vectorstore_name):
+    return resources.get(('vectordb', vectorstore_name), partial(_load_vectordb, vectorstore_name))
+
 # 1. identify_water_quality parameter
 
 def identify_water_quality_parameter(user_message):
+    # Local lookup first; the LLM is only asked when no parameter is confidently named in the query
+    local_matches = parameter_matcher.identify(user_message)
+    if local_matches:
+        return local_matches
+
     delimiter = "####"
 
     system_message = f"""
@@ -116,7 +102,7 @@ def identify_water_quality_parameter(user_message):
         {'role':'user',
          'content': f"{delimiter}{user_message}{delimiter}"},
     ]
-    output_step_1 = get_completion_by_messages(messages)
+    output_step_1 = get_completion_by_messages(messages, call_site='identify_water_quality_parameter')
     output_step_1 = eval(output_step_1)
     return output_step_1 
 
@@ -125,8 +111,8 @@ def identify_water_quality_parameter(user_message):
 
 # 2. match with PUB water quality standards and regulatory guidelines
 def get_water_quality_guidelines(list_of_water_quality_parameters: list):
-    wq_parameter_guidelines = water_quality_df[water_quality_df['Parameter List'].isin(list_of_water_quality_parameters)]
-    wq_parameter_guidelines = wq_parameter_guidelines.to_markdown()
+    # Rows are pre-rendered in the shared catalog; assembling the table is a lookup and a string join
+    wq_parameter_guidelines = parameter_catalog.to_markdown(list_of_water_quality_parameters)
     return wq_parameter_guidelines
 
 # result_step_2 = get_water_quality_guidelines(result_step_1)
@@ -135,8 +121,21 @@ def get_water_quality_guidelines(list_of_water_quality_parameters: list):
 
 def extract_email_information(user_message,vectordb_name):
     
+    rag_chain = resources.get(('rag_chain', 'extract_email_information', vectordb_name), partial(_build_email_rag_chain, vectordb_name))
+
+    try:
+        logging.debug("Invoking RAG chain...")
+        response = rag_chain.invoke({"input": user_message})
+        logging.info("RAG chain invocation successful.")
+        return response["answer"]
+    except Exception as e:
+        logging.error(f"An error occurred during RAG chain invocation: {e}")
+        return None
+
+# Retrieval chain for step 3, built once per vectordb through the resource registry
+def _build_email_rag_chain(vectordb_name):
     vectordb = vectordb_acquire(vectordb_name)
-    llm = ChatOpenAI(model='gpt-4o-mini', temperature=0)
+    llm = get_chat_model(temperature=0, call_site='extract_email_information')
     logging.debug("LLM initialized.")
 
     retriever = vectordb.as_retriever(k=4)
@@ -163,15 +162,7 @@ def extract_email_information(user_message,vectordb_name):
     question_answer_chain = create_stuff_documents_chain(llm, prompt)
     rag_chain = create_retrieval_chain(retriever, question_answer_chain)
     logging.info("RAG chain created successfully.")
-
-    try:
-        logging.debug("Invoking RAG chain...")
-        response = rag_chain.invoke({"input": user_message})
-        logging.info("RAG chain invocation successful.")
-        return response["answer"]
-    except Exception as e:
-        logging.error(f"An error occurred during RAG chain invocation: {e}")
-        return None
+    return rag_chain
 
     # result_step_3 = extract_email_information(user_input)
 
@@ -228,7 +219,7 @@ def generate_response_based_on_water_quality_standards(user_message, water_quali
          'content': f"{delimiter}{user_message}{delimiter}"},
     ]
 
-    response_to_customer = get_completion_by_messages(messages)
+    response_to_customer = get_completion_by_messages(messages, call_site='generate_response_based_on_water_quality_standards')
     # response_to_customer = response_to_customer.split(delimiter)[-1]
     return response_to_customer
 
@@ -0,0 +1,180 @@
+# Step 3 of the water quality workflow: substantiates each identified parameter with the WHO, SFA and EPH reference material.
+# Shared by logics/water_quality_query_handler.py, logics/water_quality_query_handler_async.py and
+# dev_tools/precompute_substantiation.py, so the prompt, its version and the answer cache are defined in one place.
+# - Guideline values already in the parameter catalog are quoted directly; only the remaining parameters, or every parameter
+#   of a narrative question, go through RAG.
+# - RAG answers are generated one parameter at a time and cached in data/cache/substantiation_cache.sqlite3 keyed by
+#   parameter, reference index version and prompt version.
+
+import hashlib
+import os
+import re
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain.prompts import PromptTemplate
+from langchain_community.vectorstores import Chroma
+
+from helper_functions.langchain_models import get_chat_model
+from helper_functions.resource_registry import resources, get_embeddings_model
+from helper_functions.retrieval_planner import plan_retrieval
+from helper_functions.substantiation_cache import SubstantiationCache
+from logics.water_quality_parameter_catalog import parameter_catalog
+from logics.wq_reference_ingestion import (REFERENCE_COLLECTION, REFERENCE_PERSIST_DIRECTORY, build_wq_reference_vectordb,
+                                           checkpoint_index_version, reference_build_incomplete)
+
+SUBSTANTIATION_TEMPLATE = """You are an AI tasked with finding relevant reference materials related to water quality parameters mentioned in the question. 
+    Use the provided context to formulate a concise answer. If you don't know the answer, say, "I don't know"—don't guess. 
+    Answer in 5 sentences or fewer, and cite specific sections or references where possible.
+
+    Context: {context}
+
+    Question: {question}
+
+    Your Answer: 
+    """
+# Cached answers are keyed by this hash, so editing the template invalidates them
+SUBSTANTIATION_PROMPT_VERSION = hashlib.sha256(SUBSTANTIATION_TEMPLATE.encode('utf-8')).hexdigest()[:12]
+SUBSTANTIATION_PROMPT = PromptTemplate.from_template(SUBSTANTIATION_TEMPLATE)
+SUBSTANTIATION_MAX_WORKERS = int(os.getenv('SUBSTANTIATION_MAX_WORKERS', 4))
+# Reference chunks handed to generation per parameter
+SUBSTANTIATION_TOP_K = int(os.getenv('SUBSTANTIATION_TOP_K', 10))
+NO_REFERENCES_ANSWER = "No relevant reference materials found for the given parameters."
+substantiation_cache = SubstantiationCache()
+# Index version of each loaded reference vectordb, read when that vectordb is loaded or built
+_index_versions = weakref.WeakKeyDictionary()
+
+# Questions asking for explanation rather than limits still go to the reference documents for every parameter.
+# Explicit narrative intents only (health effects, why, background); "how much/how high/what is the limit" stay catalog-first
+NARRATIVE_QUERY_PATTERN = re.compile(
+    r'\b(why|health|effects?|risks?|harm(ful)?|dangers?|dangerous|caus(e|es|ed|ing)|long[- ]term|cancer|toxic(ity)?|'
+    r'symptoms?|background|history|explain|comes? from)\b|\bhow\b[^.?!]*\baffects?\b',
+    re.IGNORECASE)
+
+
+def _open_reference_vectordb():
+    embeddings_model = get_embeddings_model('text-embedding-3-small')
+    if os.path.exists(REFERENCE_PERSIST_DIRECTORY) and not reference_build_incomplete():
+        print('VectorDB found, now loading existing vector database...')
+        # The persist directory is relative to the main directory, one level up from this script
+        root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        vectordb = Chroma(
+            persist_directory=os.path.join(root_dir, REFERENCE_PERSIST_DIRECTORY),
+            collection_name=REFERENCE_COLLECTION,
+            embedding_function=embeddings_model
+        )
+        print('wq_reference vectordb loaded successfully!')
+        return vectordb
+    print('wq_reference vector database directory not found or build incomplete, proceeding to create vector database.')
+    # Pages are extracted in parallel and cached, chunks are stored in checkpointed batches (logics/wq_reference_ingestion.py)
+    return build_wq_reference_vectordb(embeddings_model)
+
+
+def _load_reference_vectordb():
+    vectordb = _open_reference_vectordb()
+    # The ingestion checkpoint identifies the PDFs and splitter settings the chunks were built from. Indexes built before
+    # checkpoints existed fall back to the chunk count.
+    collection = vectordb._collection
+    _index_versions[vectordb] = checkpoint_index_version() or f'{collection.name}-{collection.count()}'
+    return vectordb
+
+
+def reference_vectordb():
+    # Loaded (or built) once per process and shared by every handler module
+    return resources.get(('vectordb', 'vectordb_wq_reference'), _load_reference_vectordb)
+
+
+def reference_index_version():
+    # Changes whenever the reference collection is rebuilt; re-read each time the vectordb is reloaded
+    return _index_versions[reference_vectordb()]
+
+
+def split_by_source(parameters, user_message=None):
+    # Parameters with populated regulatory columns are answered from the catalog; the rest need the RAG chain
+    if user_message and NARRATIVE_QUERY_PATTERN.search(user_message):
+        return {}, list(parameters)
+    from_catalog = {}
+    for parameter in parameters:
+        summary = parameter_catalog.regulatory_summary(parameter)
+        if summary:
+            from_catalog[parameter] = summary
+    return from_catalog, [parameter for parameter in parameters if parameter not in from_catalog]
+
+
+def merge_substantiations(parameters, from_catalog, from_references):
+    # Each parameter is labelled with the source that answered it
+    sources = {parameter: 'parameter catalog' if parameter in from_catalog else 'reference documents' for parameter in parameters}
+    print(f'Step 3 sources: {sources}')
+    return '\n\n'.join(
+        f'{parameter} [source: {sources[parameter]}]: {from_catalog.get(parameter) or from_references[parameter]}'
+        for parameter in parameters
+    )
+
+
+def unique_parameters(wq_parameters):
+    return list(dict.fromkeys(parameter.strip() for parameter in wq_parameters))
+
+
+def substantiation_question(parameter):
+    return f'Obtain the guideline values and relevant information for {parameter}'
+
+
+def substantiation_model():
+    # The sync and async paths write the same cache entries, so both must generate with this one model configuration
+    return get_chat_model(temperature=0, seed=42, call_site='substantiate_water_quality_parameter')
+
+
+def substantiation_prompt(parameter, documents):
+    context = "\n\n".join(document.page_content for document in documents)
+    return SUBSTANTIATION_PROMPT.format(context=context, question=substantiation_question(parameter))
+
+
+def _substantiate_parameter(parameter, documents):
+    # One parameter per generation call, so that answers can be cached and reused across queries.
+    # The chunks come from the retrieval plan, so nothing is retrieved here.
+    # Returns (answer, cacheable); errors are returned to the caller but not cached.
+    if not documents:
+        return NO_REFERENCES_ANSWER, True
+
+    try:
+        answer = substantiation_model().invoke(substantiation_prompt(parameter, documents))
+    except Exception as e:
+        return f"Error during QA chain execution: {str(e)}", False
+
+    return answer.content, True
+
+
+def _substantiate_many(parameters):
+    # Cached answers are looked up first. The remaining parameters are retrieved in a single pass
+    # (one batched embedding call and one multi-query search) and then generated concurrently.
+    index_version = reference_index_version()
+    answers = substantiation_cache.get_many(parameters, index_version, SUBSTANTIATION_PROMPT_VERSION)
+    missing = [parameter for parameter in parameters if parameter not in answers]
+    if missing:
+        plan = plan_retrieval(reference_vectordb(), [substantiation_question(parameter) for parameter in missing],
+                              k=SUBSTANTIATION_TOP_K, call_site='substantiate_water_quality_parameter')
+        documents = [plan.documents_for(position) for position in range(len(missing))]
+        with ThreadPoolExecutor(max_workers=min(len(missing), SUBSTANTIATION_MAX_WORKERS)) as executor:
+            for parameter, (answer, cacheable) in zip(missing, executor.map(_substantiate_parameter, missing, documents)):
+                answers[parameter] = answer
+                if cacheable:
+                    substantiation_cache.put(parameter, index_version, SUBSTANTIATION_PROMPT_VERSION, answer)
+    return answers
+
+
+def substantiate_water_quality_parameter(wq_parameters, user_message=None):
+    # Parameters are substantiated one by one and merged in the order given, so the same list always gives the same text.
+    parameters = unique_parameters(wq_parameters)
+    if not parameters:
+        return NO_REFERENCES_ANSWER
+    from_catalog, rag_parameters = split_by_source(parameters, user_message)
+    from_references = _substantiate_many(rag_parameters) if rag_parameters else {}
+    return merge_substantiations(parameters, from_catalog, from_references)
+
+
+# Batch job: fills the substantiation cache for every catalog parameter so that the online path is a lookup
+def precompute_substantiations(parameters=None):
+    parameters = unique_parameters(parameters or parameter_catalog.parameter_list)
+    answers = _substantiate_many(parameters)
+    print(f'Substantiations cached for {len(answers)} parameters: {substantiation_cache.stats()}')
+    return answers
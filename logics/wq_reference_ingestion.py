@@ -0,0 +1,210 @@
+# Parallel, resumable build of the water quality reference index (data/vectordb_wq_reference).
+# - Page text is extracted in a process pool, in page ranges, and cached per (file hash, page) in
+#   data/cache/pdf_pages.sqlite3, so a rebuild or a resumed build does not extract the PDFs again.
+# - Pages stream in document order through the splitter into bounded batches that are embedded and upserted one by one,
+#   instead of one Chroma.from_documents call at the very end.
+# - Chunk ids are stable ("<file key>:<page>:<chunk number>") and a checkpoint next to the collection records how many
+#   chunks are stored. An interrupted build resumes after the last stored batch; a finished build is marked complete.
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from langchain_community.vectorstores import Chroma
+from langchain_core.documents import Document
+from pypdf import PdfReader
+
+from helper_functions.token_splitter import TokenOffsetTextSplitter
+
+REFERENCE_PDFS = (
+    'data/code-of-practice-on-drinking-water-sampling-and-safety-plans-sfa-apr-2019.pdf',
+    'data/WHO GDWQ 4th ed 1st 2nd addenda 2022-eng.pdf',
+    'data/Environmental Public Health (Water suitable for drinking)(No. 2) Regulations SFA Apr 2019.pdf',
+)
+REFERENCE_COLLECTION = 'wq_reference'
+REFERENCE_PERSIST_DIRECTORY = 'data/vectordb_wq_reference'
+CHECKPOINT_PATH = os.path.join(REFERENCE_PERSIST_DIRECTORY, 'ingestion_checkpoint.json')
+PDF_PARSE_WORKERS = int(os.getenv('PDF_PARSE_WORKERS', os.cpu_count() or 1))
+PAGES_PER_TASK = 16
+UPSERT_BATCH_SIZE = 128
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
+
+
+def reference_splitter():
+    # Same separators and token budget as the former RecursiveCharacterTextSplitter(length_function=count_tokens),
+    # with each page encoded once instead of once per candidate piece
+    return TokenOffsetTextSplitter(
+        separators=["\n\n", "\n", " ", ""],
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+    )
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def page_count(path):
+    return len(PdfReader(path).pages)
+
+
+def _extract_pages(path, start, end):
+    # Runs in a worker process: [(page, text)] for pages start..end-1, extracted as PyPDFLoader does.
+    reader = PdfReader(path)
+    return [(page, reader.pages[page].extract_text()) for page in range(start, end)]
+
+
+class PageCache:
+    def __init__(self, path='data/cache/pdf_pages.sqlite3'):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS pages ('
+            'file_hash TEXT NOT NULL, page INTEGER NOT NULL, text TEXT NOT NULL, '
+            'PRIMARY KEY (file_hash, page))'
+        )
+        self._conn.commit()
+
+    def get_all(self, digest):
+        # {page: text} for the pages of this file that are cached
+        with self._lock:
+            rows = self._conn.execute('SELECT page, text FROM pages WHERE file_hash = ?', (digest,)).fetchall()
+        return dict(rows)
+
+    def put_many(self, digest, pages):
+        with self._lock:
+            self._conn.executemany('INSERT OR REPLACE INTO pages (file_hash, page, text) VALUES (?, ?, ?)',
+                                   [(digest, page, text) for page, text in pages])
+            self._conn.commit()
+
+
+def iter_pages(sources, page_cache, max_workers=PDF_PARSE_WORKERS):
+    # Yields page Documents (metadata source and page, as from PyPDFLoader) of every source in order. Ranges missing from
+    # the cache are all submitted to the pool up front and consumed in order, so extraction runs ahead of the consumer.
+    with ProcessPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        plans = []
+        for path, digest in sources:
+            cached = page_cache.get_all(digest)
+            total = page_count(path)
+            ranges = []
+            for start in range(0, total, PAGES_PER_TASK):
+                end = min(start + PAGES_PER_TASK, total)
+                if all(page in cached for page in range(start, end)):
+                    ranges.append((start, end, None))
+                else:
+                    ranges.append((start, end, executor.submit(_extract_pages, path, start, end)))
+            plans.append((path, digest, cached, ranges))
+
+        for path, digest, cached, ranges in plans:
+            for start, end, future in ranges:
+                if future is not None:
+                    extracted = future.result()
+                    page_cache.put_many(digest, extracted)
+                    cached.update(extracted)
+                for page in range(start, end):
+                    yield Document(page_content=cached[page], metadata={'source': path, 'page': page})
+
+
+def load_checkpoint(path=CHECKPOINT_PATH):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_checkpoint(checkpoint, path=CHECKPOINT_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = path + '.tmp'
+    with open(temporary, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, indent=1)
+    os.replace(temporary, path)
+
+
+def reference_build_incomplete():
+    # True when a build was started but not finished; indexes built before checkpoints existed count as complete.
+    checkpoint = load_checkpoint()
+    return checkpoint is not None and not checkpoint.get('complete')
+
+
+def checkpoint_index_version():
+    # Build key and chunk count of the finished build; None when there is no finished checkpoint to go by.
+    checkpoint = load_checkpoint()
+    if checkpoint is None or not checkpoint.get('complete'):
+        return None
+    return f"{REFERENCE_COLLECTION}-{checkpoint['build_key'][:12]}-{checkpoint['chunks_stored']}"
+
+
+def _build_key(sources):
+    # A build resumes only if the PDFs and the splitter settings are those the checkpoint was written for.
+    settings = {'files': [digest for _, digest in sources], 'splitter': 'token_offset', 'chunk_size': CHUNK_SIZE,
+                'chunk_overlap': CHUNK_OVERLAP}
+    return hashlib.sha256(json.dumps(settings).encode('utf-8')).hexdigest()
+
+
+def _iter_chunks(pages, splitter):
+    # (chunk id, Document) in document order
+    for page in pages:
+        key = hashlib.sha1(page.metadata['source'].encode('utf-8')).hexdigest()[:16]
+        for number, chunk in enumerate(splitter.split_documents([page])):
+            yield f'{key}:{page.metadata["page"]}:{number}', chunk
+
+
+def _upsert(vectordb, embeddings_model, batch):
+    texts = [chunk.page_content for _, chunk in batch]
+    vectordb._collection.upsert(
+        ids=[chunk_id for chunk_id, _ in batch],
+        documents=texts,
+        metadatas=[chunk.metadata for _, chunk in batch],
+        embeddings=embeddings_model.embed_documents(texts),
+    )
+
+
+def build_wq_reference_vectordb(embeddings_model, pdfs=REFERENCE_PDFS, max_workers=PDF_PARSE_WORKERS,
+                                batch_size=UPSERT_BATCH_SIZE):
+    sources = [(path, file_hash(path)) for path in pdfs]
+    build_key = _build_key(sources)
+    checkpoint = load_checkpoint()
+    if checkpoint is None or checkpoint.get('build_key') != build_key:
+        checkpoint = {'build_key': build_key, 'chunks_stored': 0, 'complete': False}
+    vectordb = Chroma(
+        collection_name=REFERENCE_COLLECTION,
+        embedding_function=embeddings_model,
+        persist_directory=REFERENCE_PERSIST_DIRECTORY,
+    )
+    if checkpoint['complete']:
+        return vectordb
+    if checkpoint['chunks_stored'] == 0 and vectordb._collection.count():
+        # Chunks of an older build (other PDFs, splitter settings or random ids) would otherwise linger next to the new ones
+        vectordb.delete(ids=vectordb._collection.get(include=[])['ids'])
+    save_checkpoint(checkpoint)
+    resume_from = checkpoint['chunks_stored']
+    if resume_from:
+        print(f'Resuming {REFERENCE_COLLECTION} build after {resume_from} stored chunks.')
+
+    batch = []
+    position = 0
+    for chunk_id, chunk in _iter_chunks(iter_pages(sources, PageCache(), max_workers), reference_splitter()):
+        position += 1
+        if position <= resume_from:
+            continue
+        batch.append((chunk_id, chunk))
+        if len(batch) >= batch_size:
+            _upsert(vectordb, embeddings_model, batch)
+            checkpoint['chunks_stored'] = position
+            save_checkpoint(checkpoint)
+            batch = []
+    if batch:
+        _upsert(vectordb, embeddings_model, batch)
+    checkpoint.update(chunks_stored=position, complete=True)
+    save_checkpoint(checkpoint)
+    print(f'{REFERENCE_COLLECTION} built: {position} chunks from {len(sources)} documents.')
+    return vectordb